@@ -1,29 +1,47 @@
+import hashlib
+import json
 import os
+import posixpath
 import re
 import socket
+import tarfile
+import tempfile
 import time
 import urllib
 import xml.etree.ElementTree as ETree
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from ftplib import FTP, CRLF, Error, error_perm
+from ftplib import FTP, CRLF, Error, error_perm, all_errors
 from http.client import RemoteDisconnected
 from telnetlib import Telnet
+from threading import Lock
 from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
 from urllib.request import (urlopen, HTTPPasswordMgrWithDefaultRealm, HTTPBasicAuthHandler, build_opener,
                             install_opener, Request)
 
 from app.commons import log, run_task
-from app.settings import SettingsType
+from app.eparser.ecommons import write_atomically
+from app.settings import SettingsType, CONFIG_PATH
 
 BQ_FILES_LIST = ("tv", "radio",  # enigma 2
                  "myservices.xml", "bouquets.xml", "ubouquets.xml")  # neutrino
+# Remote bouquets files deleted as unused.
+USER_BQ_FILES = ("userbouquet.", "bouquets.xml", "ubouquets.xml")
 
 DATA_FILES_LIST = ("lamedb", "lamedb5", "blacklist", "whitelist",)
 
 STC_XML_FILE = ("satellites.xml", "terrestrial.xml", "cables.xml")
 WEB_TV_XML_FILE = ("webtv.xml",)
 PICONS_SUF = (".jpg", ".png")
+ARCHIVE_NAME = "demon-editor-upload.tar.gz"
+ARCHIVE_PATH = "/tmp/"  # Remote path for the uploaded archive.
+ARCHIVE_TIMEOUT = 60  # Max time [sec] to unpack the archive in the receiver.
+GUI_TIMEOUT = 60  # Max time [sec] to wait for the receiver GUI to stop.
+# Modify time is a string from the MLSD [YYYYMMDDHHMMSS] or LIST [e.g. Jan 10 12:30] output.
+RemoteFile = namedtuple("RemoteFile", ["name", "size", "modify"])
 
 
 class DownloadType(Enum):
@@ -74,12 +92,40 @@ class UtfFTP(FTP):
                 callback(line)
         return self.voidresp()
 
+    def list_files(self):
+        """ Returns a dict of the regular files in the current directory [name -> RemoteFile].
+
+            MLSD is used if supported by the server, otherwise the LIST output is parsed.
+        """
+        try:
+            return {n: RemoteFile(n, int(f.get("size", -1)), f.get("modify")) for n, f in
+                    self.mlsd(facts=("type", "size", "modify")) if f.get("type") == "file"}
+        except error_perm:
+            pass  # MLSD is not supported.
+
+        lines = []
+        self.dir(lines.append)
+        files = {}
+        for line in lines:
+            f_data = line.split(None, 8)
+            if len(f_data) == 9 and f_data[0].startswith("-"):
+                size = int(f_data[4]) if f_data[4].isdigit() else -1
+                files[f_data[8]] = RemoteFile(f_data[8], size, " ".join(f_data[5:8]))
+        return files
+
     # ***************** Download ******************* #
 
-    def download_files(self, save_path, file_list, callback=None):
-        """ Downloads files from the receiver via FTP. """
-        for file in filter(lambda s: s.endswith(file_list), self.nlst()):
-            self.download_file(file, save_path, callback)
+    def download_files(self, save_path, file_list, callback=None, transfer=None):
+        """ Downloads files from the receiver via FTP.
+
+            If the transfer is set, files are downloaded in parallel over several connections.
+        """
+        files = [f for f in self.nlst() if f.endswith(file_list)]
+        if transfer:
+            transfer.download(self.pwd(), save_path, files, callback)
+        else:
+            for file in files:
+                self.download_file(file, save_path, callback)
 
     def download_file(self, name, save_path, callback=None):
         with open(save_path + name, "wb") as f:
@@ -139,28 +185,47 @@ class UtfFTP(FTP):
         self.cwd(xml_path)
         self.download_files(data_path, xml_files, callback)
 
-    def download_picons(self, src, dest, callback, files_filter=None):
+    def download_picons(self, src, dest, callback, files_filter=None, transfer=None):
         try:
             self.cwd(src)
         except error_perm as e:
             callback(str(e))
             return
 
-        for file in filter(picons_filter_function(files_filter), self.nlst()):
-            self.download_file(file, dest, callback)
+        files = [f for f in self.nlst() if picons_filter_function(files_filter)(f)]
+        if transfer:
+            transfer.download(src, dest, files, callback)
+        else:
+            for file in files:
+                self.download_file(file, dest, callback)
 
     # ***************** Uploading ******************* #
 
-    def upload_bouquets(self, data_path, remove_unused, callback):
+    def upload_bouquets(self, data_path, remove_unused, callback, transfer=None):
+        """ Uploads bouquets files to the current directory.
+
+            In the sync mode, only the remote bouquets missing from the local ones are deleted as unused,
+            so unchanged bouquets are not sent again.
+        """
+        if transfer and transfer.is_sync:
+            orphans_filter = (lambda f: f.startswith(USER_BQ_FILES)) if remove_unused else None
+            transfer.upload(data_path, self.pwd(), get_upload_files(data_path, BQ_FILES_LIST), callback, orphans_filter)
+            return
+
         if remove_unused:
             self.remove_unused_bouquets(callback)
-        self.upload_files(data_path, BQ_FILES_LIST, callback)
+        self.upload_files(data_path, BQ_FILES_LIST, callback, transfer)
 
-    def upload_files(self, data_path, file_list, callback):
-        for file_name in os.listdir(data_path):
-            if file_name in STC_XML_FILE or file_name in WEB_TV_XML_FILE:
-                continue
-            if file_name.endswith(file_list):
+    def upload_files(self, data_path, file_list, callback, transfer=None):
+        """ Uploads files to the current directory.
+
+            If the transfer is set, files are uploaded in parallel over several connections.
+        """
+        files = get_upload_files(data_path, file_list)
+        if transfer:
+            transfer.upload(data_path, self.pwd(), files, callback)
+        else:
+            for file_name in files:
                 self.send_file(file_name, data_path, callback)
 
     def upload_xml(self, data_path, xml_path, xml_files, callback):
@@ -169,7 +234,11 @@ class UtfFTP(FTP):
         for xml_file in xml_files:
             self.send_file(xml_file, data_path, callback)
 
-    def upload_picons(self, src, dest, callback, files_filter=None):
+    def upload_picons(self, src, dest, callback, files_filter=None, transfer=None, remove_unused=False):
+        """ Uploads picons to the receiver.
+
+            If remove_unused is set, remote picons missing from the source are deleted [sync mode only].
+        """
         try:
             self.cwd(dest)
         except error_perm as e:
@@ -177,13 +246,17 @@ class UtfFTP(FTP):
                 self.mkd(dest)  # if not exist
                 self.cwd(dest)
 
-        for file_name in filter(picons_filter_function(files_filter), os.listdir(src)):
-            self.send_file(file_name, src, callback)
-
-    def remove_unused_bouquets(self, callback):
-        bq_files = ("userbouquet.", "bouquets.xml", "ubouquets.xml")
+        files = [f for f in os.listdir(src) if picons_filter_function(files_filter)(f)]
+        if transfer:
+            orphans_filter = picons_filter_function() if remove_unused and not files_filter else None
+            transfer.upload(src, dest, files, callback, orphans_filter)
+        else:
+            for file_name in files:
+                self.send_file(file_name, src, callback)
 
-        for file in filter(lambda f: f.startswith(bq_files), self.nlst()):
+    def remove_unused_bouquets(self, callback, keep=()):
+        """ Deletes the bouquets files from the current directory except the [keep] ones. """
+        for file in filter(lambda f: f.startswith(USER_BQ_FILES) and f not in keep, self.nlst()):
             self.delete_file(file, callback)
 
     def send_file(self, file_name, path, callback=None):
@@ -324,17 +397,428 @@ class UtfFTP(FTP):
         return resp
 
 
-def download_data(*, settings, download_type=DownloadType.ALL, callback=log, files_filter=None):
-    with UtfFTP(host=settings.host, user=settings.user, passwd=settings.password) as ftp:
+class FtpPool:
+    """ Pool of the authenticated FTP connections.
+
+        Connections are kept alive between tasks to avoid a new login for each transfer.
+        Idle connections are checked [NOOP] before reuse and closed after the idle timeout.
+    """
+    _POOLS = {}
+    _LOCK = Lock()
+
+    def __init__(self, host, user, password, max_idle=4, idle_timeout=120, timeout=30):
+        self._host = host
+        self._user = user
+        self._password = password
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._idle = []  # (connection, release time)
+        self._home = {}  # initial working directories
+        self._lock = Lock()
+
+    @property
+    def host(self):
+        return self._host
+
+    @classmethod
+    def get(cls, settings):
+        """ Returns the shared pool for the current connection settings. """
+        key = (settings.host, settings.user, settings.password)
+        with cls._LOCK:
+            pool = cls._POOLS.get(key)
+            if pool is None:
+                pool = cls(*key)
+                cls._POOLS[key] = pool
+            return pool
+
+    @classmethod
+    def close_all(cls):
+        with cls._LOCK:
+            pools = list(cls._POOLS.values())
+            cls._POOLS.clear()
+
+        for pool in pools:
+            pool.close()
+
+    @contextmanager
+    def connection(self):
+        """ Returns the connection to the pool after use. Broken connections are discarded. """
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except BaseException:
+            self.discard(ftp)
+            raise
+        else:
+            self.release(ftp)
+
+    def acquire(self):
+        self.expire()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                ftp, released = self._idle.pop()
+
+            if time.monotonic() - released > self._idle_timeout:
+                self.discard(ftp)
+                continue
+
+            try:
+                ftp.voidcmd("NOOP")
+            except all_errors:
+                self.discard(ftp)
+            else:
+                return ftp
+
+        return self.connect()
+
+    def connect(self):
+        ftp = UtfFTP(host=self._host, user=self._user, passwd=self._password, timeout=self._timeout)
         ftp.encoding = "utf-8"
+        with self._lock:
+            self._home[ftp] = ftp.pwd()
+        return ftp
+
+    def release(self, ftp):
+        """ Returns the connection to the pool with the initial working directory. """
+        try:
+            ftp.cwd(self._home.get(ftp, "/"))
+        except all_errors:
+            self.discard(ftp)
+            return
+
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append((ftp, time.monotonic()))
+                return
+        self.discard(ftp)
+
+    def discard(self, ftp):
+        with self._lock:
+            self._home.pop(ftp, None)
+
+        try:
+            ftp.quit()
+        except all_errors:
+            ftp.close()
+
+    def expire(self):
+        """ Closes the connections which have been idle longer than the idle timeout. """
+        deadline = time.monotonic() - self._idle_timeout
+        with self._lock:
+            expired = [ftp for ftp, released in self._idle if released < deadline]
+            self._idle = [(ftp, released) for ftp, released in self._idle if released >= deadline]
+
+        for ftp in expired:
+            self.discard(ftp)
+
+    def close(self):
+        with self._lock:
+            idle = [ftp for ftp, released in self._idle]
+            self._idle.clear()
+
+        for ftp in idle:
+            self.discard(ftp)
+
+
+class FtpTransfer:
+    """ Parallel transfer of files over several connections from the FTP pool.
+
+        Workers take files from a common queue. Failed files are retried.
+        Progress messages are passed to the callback in the order of the files list.
+        If the manifest is set, only added or changed files are transferred [delta sync].
+    """
+    MAX_WORKERS = 8  # To limit the load on the receiver.
+
+    def __init__(self, pool, workers=4, retries=2, manifest=None):
+        self._pool = pool
+        self._workers = max(1, min(workers, self.MAX_WORKERS))
+        self._retries = retries
+        self._manifest = manifest
+
+    @property
+    def is_sync(self):
+        return self._manifest is not None
+
+    def download(self, path, save_path, files, callback=None):
+        """ Downloads files from the remote path. Returns a list of the responses. """
+        if self._manifest is None:
+            return self.run(path, files, lambda ftp, f, cb: ftp.download_file(f, save_path, cb), callback)
+        return self.sync(path, save_path, files, lambda ftp, f, cb: ftp.download_file(f, save_path, cb), callback)
+
+    def upload(self, path, dest, files, callback=None, orphans_filter=None):
+        """ Uploads files from the local path to the remote [dest] one. Returns a list of the responses.
+
+            @param orphans_filter: in the sync mode, remote files matching this filter
+                                   and missing from the files list are deleted.
+        """
+        if self._manifest is None:
+            return self.run(dest, files, lambda ftp, f, cb: ftp.send_file(f, path, cb), callback)
+        return self.sync(dest, path, files, lambda ftp, f, cb: ftp.send_file(f, path, cb), callback, orphans_filter)
+
+    def sync(self, path, local_path, files, transfer, callback=None, orphans_filter=None):
+        """ Transfers files which differ from the last synced state stored in the manifest. """
+        callback = callback or (lambda m: log(m.rstrip()))
+        files = list(files)
+        entries = self._manifest.get_entries(self._pool.host, path)
+        remote = self.list_files(path)
+        changed = [f for f in files if is_changed(entries.get(f), remote.get(f), local_path + f)]
+        if len(changed) < len(files):
+            callback("Unchanged files: {}. Skipping.\n".format(len(files) - len(changed)))
+
+        results = self.run(path, changed, transfer, callback)
+
+        if orphans_filter:
+            names = set(files)
+            orphans = [f for f in remote if orphans_filter(f) and f not in names]
+            if orphans:
+                with self._pool.connection() as ftp:
+                    ftp.cwd(path)
+                    for f in orphans:
+                        if ftp.delete_file(f, callback).startswith("2"):
+                            entries.pop(f, None)
+
+        failed = {f for f, resp in zip(changed, results) if not resp.startswith("2")}
+        if changed:
+            remote = self.list_files(path)  # To get the new size and modify time.
+
+        for f in files:
+            if f in failed:
+                entries.pop(f, None)
+            else:
+                update_entry(entries, f, remote.get(f), local_path + f)
+        self._manifest.save()
+
+        return results
+
+    def get_changed(self, local_path, files):
+        """ Returns (file name, remote dir) pairs of the files which differ from the last synced state.
+
+            Used when files are transferred in another way [e.g. in the archive].
+            Without the manifest, all files are returned.
+        """
+        files = list(files)
+        if self._manifest is None:
+            return files
+
+        changed = []
+        for path, names in group_by_path(files).items():
+            entries = self._manifest.get_entries(self._pool.host, path)
+            remote = self.list_files(path)
+            changed.extend((f, path) for f in names if is_changed(entries.get(f), remote.get(f), local_path + f))
+        return changed
+
+    def update_manifest(self, local_path, files):
+        """ Stores the current state of the transferred (file name, remote dir) pairs in the manifest. """
+        if self._manifest is None:
+            return
+
+        for path, names in group_by_path(files).items():
+            entries = self._manifest.get_entries(self._pool.host, path)
+            remote = self.list_files(path)
+            for f in names:
+                update_entry(entries, f, remote.get(f), local_path + f)
+        self._manifest.save()
+
+    def list_files(self, path):
+        with self._pool.connection() as ftp:
+            ftp.cwd(path)
+            return ftp.list_files()
+
+    def run(self, path, files, transfer, callback=None):
+        files = list(files)
+        if not files:
+            return []
+
+        callback = callback or (lambda m: log(m.rstrip()))
+        queue = deque(enumerate(files))
+        results = [None] * len(files)
+        messages = {}
+        lock = Lock()
+        pos = 0
+
+        def done(index, resp, msg):
+            nonlocal pos
+            with lock:
+                results[index] = resp
+                messages[index] = msg
+                while pos in messages:
+                    msg = messages.pop(pos)
+                    if msg:
+                        callback(msg)
+                    pos += 1
+
+        connections = []
+        try:
+            for i in range(min(self._workers, len(files))):
+                connections.append(self.connect(path))
+        except all_errors as e:
+            if not connections:
+                raise
+            log("FTP transfer: only {} connection(s) opened. {}".format(len(connections), e))
+
+        with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            futures = [executor.submit(self.work, ftp, path, queue, transfer, done) for ftp in connections]
+
+        errors = list(filter(None, (f.exception() for f in futures)))
+        if errors:
+            raise errors[0]
+
+        for index, name in queue:
+            done(index, "500 Not transferred.", "Transfer file: {}.   Status: Not transferred.\n".format(name))
+
+        return results
+
+    def work(self, ftp, path, queue, transfer, done):
+        """ Transfers files from the queue until it is empty or the connection is lost. """
+        try:
+            while ftp:
+                try:
+                    index, name = queue.popleft()
+                except IndexError:
+                    break
+
+                for attempt in range(self._retries + 1):
+                    msgs = []
+                    try:
+                        if not ftp:
+                            ftp = self.connect(path)
+                        resp = transfer(ftp, name, msgs.append)
+                    except all_errors as e:
+                        resp = "500 {}".format(e)
+                        msgs = ["Transfer file: {}.   Status: {}\n".format(name, e)]
+                        if is_local_error(e):
+                            break  # The connection is still usable.
+                        if ftp:
+                            self._pool.discard(ftp)
+                            ftp = None
+                    else:
+                        if not resp.startswith("4"):
+                            break  # Temporary errors [4xx] only are retried.
+
+                    if attempt < self._retries:
+                        log("FTP transfer: retrying '{}'. {}".format(name, resp))
+                        time.sleep(attempt + 1)
+
+                done(index, resp, "".join(msgs))
+        except BaseException:
+            if ftp:
+                self._pool.discard(ftp)  # The state of the connection is unknown.
+                ftp = None
+            raise
+        finally:
+            if ftp:
+                self._pool.release(ftp)
+
+    def connect(self, path):
+        ftp = self._pool.acquire()
+        try:
+            ftp.cwd(path)
+        except all_errors:
+            self._pool.discard(ftp)
+            raise
+        return ftp
+
+
+def is_local_error(error):
+    """ Checks if the error is raised by the local file operation [not by the FTP connection]. """
+    return isinstance(error, OSError) and error.filename is not None
+
+
+class FtpManifest:
+    """ Local manifest of the synced files.
+
+        For each remote directory it stores: name -> [remote size, remote modify, local size, local mtime, md5].
+    """
+
+    def __init__(self, path=CONFIG_PATH + "ftp_manifest.json"):
+        self._path = path
+        self._data = {}
+
+    def load(self):
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log("FTP manifest loading error: {}".format(e))
+        return self
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with write_atomically(self._path, encoding="utf-8") as f:
+                json.dump(self._data, f)
+        except OSError as e:
+            log("FTP manifest writing error: {}".format(e))
+
+    def get_entries(self, host, path):
+        return self._data.setdefault("{}:{}".format(host, path.rstrip("/") or "/"), {})
+
+
+def is_changed(entry, remote, local_path):
+    """ Checks if the local or remote file differs from the last synced state. """
+    if not entry or not remote:
+        return True
+
+    try:
+        st = os.stat(local_path)
+    except OSError:
+        return True
+
+    if st.st_size != remote.size or [remote.size, remote.modify] != entry[:2]:
+        return True
+    if [st.st_size, st.st_mtime_ns] == entry[2:4]:
+        return False
+    return get_md5(local_path) != entry[4]  # The file was touched or rewritten.
+
+
+def update_entry(entries, name, remote, local_path):
+    try:
+        st = os.stat(local_path)
+    except OSError:
+        st = None
+
+    if not remote or not st:
+        entries.pop(name, None)
+        return
+
+    entry = entries.get(name)
+    md5 = entry[4] if entry and [st.st_size, st.st_mtime_ns] == entry[2:4] else get_md5(local_path)
+    entries[name] = [remote.size, remote.modify, st.st_size, st.st_mtime_ns, md5]
+
+
+def group_by_path(files):
+    """ Returns a dict of the file names by the remote dir from the (file name, remote dir) pairs. """
+    groups = {}
+    for name, path in files:
+        groups.setdefault(path, []).append(name)
+    return groups
+
+
+def get_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def download_data(*, settings, download_type=DownloadType.ALL, callback=log, files_filter=None, sync=False):
+    pool = FtpPool.get(settings)
+    with pool.connection() as ftp:
         callback("FTP OK.\n")
+        transfer = FtpTransfer(pool, manifest=FtpManifest().load() if sync else None)
         save_path = settings.data_local_path
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         # bouquets
         if download_type is DownloadType.ALL or download_type is DownloadType.BOUQUETS:
             ftp.cwd(settings.services_path)
             file_list = BQ_FILES_LIST + DATA_FILES_LIST if download_type is DownloadType.ALL else BQ_FILES_LIST
-            ftp.download_files(save_path, file_list, callback)
+            ftp.download_files(save_path, file_list, callback, transfer)
         # *.xml and webtv
         if download_type in (DownloadType.ALL, DownloadType.SATELLITES):
             ftp.download_xml(save_path, settings.satellites_xml_path, STC_XML_FILE, callback)
@@ -344,7 +828,7 @@ def download_data(*, settings, download_type=DownloadType.ALL, callback=log, fil
         if download_type is DownloadType.PICONS:
             picons_path = settings.picons_local_path
             os.makedirs(os.path.dirname(picons_path), exist_ok=True)
-            ftp.download_picons(settings.picons_path, picons_path, callback, files_filter)
+            ftp.download_picons(settings.picons_path, picons_path, callback, files_filter, transfer)
         # epg.dat
         if download_type is DownloadType.EPG:
             stb_path = settings.services_path
@@ -360,7 +844,13 @@ def download_data(*, settings, download_type=DownloadType.ALL, callback=log, fil
 
 
 def upload_data(*, settings, download_type=DownloadType.ALL, remove_unused=False,
-                callback=log, done_callback=None, use_http=False, files_filter=None):
+                callback=log, done_callback=None, use_http=False, files_filter=None, sync=False, use_archive=False):
+    """ Uploads data to the receiver.
+
+        In the sync mode, only added or changed files are transferred.
+        If use_archive is set, all files [DownloadType.ALL] are uploaded as a single archive
+        and unpacked in the receiver via telnet [in the sync mode, only the changed ones]. Not used with HTTP.
+    """
     s_type = settings.setting_type
     data_path = settings.data_local_path
     host = settings.host
@@ -392,19 +882,24 @@ def upload_data(*, settings, download_type=DownloadType.ALL, remove_unused=False
         else:
             if download_type is not DownloadType.PICONS:
                 # telnet
-                tn = telnet(host=host,
-                            user=settings.user,
-                            password=settings.password,
-                            timeout=settings.telnet_timeout)
-                next(tn)
+                tn = TelnetSession(host=host,
+                                   user=settings.user,
+                                   password=settings.password,
+                                   timeout=settings.telnet_timeout)
+                tn.login()
                 # terminate enigma or neutrino
                 callback("Telnet initialization ...\n")
-                tn.send("init 4")
                 callback("Stopping GUI...\n")
-
-        with UtfFTP(host=host, user=settings.user, passwd=settings.password) as ftp:
-            ftp.encoding = "utf-8"
+                # init returns immediately, so waiting until the GUI has written its files and exited.
+                gui = "enigma2" if s_type is SettingsType.ENIGMA_2 else "neutrino"
+                status, output = tn.run("init 4; while pidof {} > /dev/null; do sleep 1; done".format(gui), GUI_TIMEOUT)
+                if status is None:
+                    callback("The GUI is not stopped within {} sec!\n".format(GUI_TIMEOUT))
+
+        pool = FtpPool.get(settings)
+        with pool.connection() as ftp:
             callback("FTP OK.\n")
+            transfer = FtpTransfer(pool, manifest=FtpManifest().load() if sync else None)
             sat_xml_path = settings.satellites_xml_path
             services_path = settings.services_path
 
@@ -416,23 +911,34 @@ def upload_data(*, settings, download_type=DownloadType.ALL, remove_unused=False
 
             if download_type is DownloadType.BOUQUETS:
                 ftp.cwd(services_path)
-                ftp.upload_bouquets(data_path, remove_unused, callback)
+                ftp.upload_bouquets(data_path, remove_unused, callback, transfer)
 
             if download_type is DownloadType.ALL:
-                ftp.upload_xml(data_path, sat_xml_path, STC_XML_FILE, callback)
-                if s_type is SettingsType.NEUTRINO_MP:
-                    ftp.upload_xml(data_path, sat_xml_path, WEB_TV_XML_FILE, callback)
-
-                ftp.cwd(services_path)
-                ftp.upload_bouquets(data_path, remove_unused, callback)
-                ftp.upload_files(data_path, DATA_FILES_LIST, callback)
+                xml_files = STC_XML_FILE + WEB_TV_XML_FILE if s_type is SettingsType.NEUTRINO_MP else STC_XML_FILE
+                files = [(f, sat_xml_path) for f in xml_files if os.path.isfile(data_path + f)]
+                files.extend((f, services_path) for f in get_upload_files(data_path, BQ_FILES_LIST + DATA_FILES_LIST))
+
+                uploaded = False
+                if use_archive and tn:
+                    if remove_unused:
+                        # Bouquets from the archive are overwritten, so they are not deleted.
+                        ftp.cwd(services_path)
+                        ftp.remove_unused_bouquets(callback, {f for f, path in files if path == services_path})
+                    uploaded = upload_archive(ftp, tn, transfer, data_path, files, callback)
+
+                if not uploaded:
+                    ftp.upload_xml(data_path, sat_xml_path, xml_files, callback)
+                    ftp.cwd(services_path)
+                    ftp.upload_bouquets(data_path, remove_unused, callback, transfer)
+                    ftp.upload_files(data_path, DATA_FILES_LIST, callback, transfer)
 
             if download_type is DownloadType.PICONS:
-                ftp.upload_picons(settings.picons_local_path, settings.picons_path, callback, files_filter)
+                ftp.upload_picons(settings.picons_local_path, settings.picons_path, callback, files_filter, transfer,
+                                  remove_unused)
 
             if tn and not use_http:
                 # resume enigma or restart neutrino
-                tn.send("init 3" if s_type is SettingsType.ENIGMA_2 else "init 6")
+                tn.run("init 3" if s_type is SettingsType.ENIGMA_2 else "init 6")
                 callback("Starting...\n" if s_type is SettingsType.ENIGMA_2 else "Rebooting...\n")
             elif ht and use_http:
                 if download_type is DownloadType.BOUQUETS:
@@ -450,11 +956,68 @@ def upload_data(*, settings, download_type=DownloadType.ALL, remove_unused=False
             ht.close()
 
 
+def get_upload_files(data_path, file_list):
+    """ Returns names of the local files for upload excluding *.xml ones. """
+    return [f for f in os.listdir(data_path) if f.endswith(file_list) and f not in STC_XML_FILE + WEB_TV_XML_FILE]
+
+
+def upload_archive(ftp, tn, transfer, data_path, files, callback):
+    """ Uploads files as a single archive and unpacks it in the receiver.
+
+        @param files: list of (file name, remote dir) pairs.
+        Returns False if the files should be uploaded in the usual way.
+    """
+    changed = transfer.get_changed(data_path, files)
+    if len(changed) < len(files):
+        callback("Unchanged files: {}. Skipping.\n".format(len(files) - len(changed)))
+    if not changed:
+        return True
+
+    archive = ARCHIVE_PATH + ARCHIVE_NAME
+    if not send_archive(ftp, data_path, changed, callback):
+        tn.run("rm -f {}".format(archive))
+        return False
+
+    callback("Unpacking archive...\n")
+    # The archive is removed regardless of the unpacking result.
+    status, output = tn.run("tar -xzf {0} -C /; s=$?; rm -f {0}; (exit $s)".format(archive), ARCHIVE_TIMEOUT)
+    if status != 0:
+        callback("Unpacking error: {}\n".format(output or status))
+        return False
+
+    transfer.update_manifest(data_path, changed)
+    return True
+
+
+def send_archive(ftp, data_path, files, callback):
+    """ Packs files into a single tar.gz archive and uploads it to the receiver.
+
+        @param files: list of (file name, remote dir) pairs.
+        Returns the remote archive path or None if the upload failed.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        with tarfile.open(os.path.join(tmp, ARCHIVE_NAME), "w:gz") as tar:
+            for name, path in files:
+                info = tar.gettarinfo(data_path + name, posixpath.join(path, name).lstrip("/"))
+                info.uid, info.gid, info.uname, info.gname = 0, 0, "root", "root"
+                with open(data_path + name, "rb") as f:
+                    tar.addfile(info, f)
+
+        callback("Packed files: {}.\n".format(len(files)))
+        try:
+            ftp.cwd(ARCHIVE_PATH)
+        except Error as e:
+            log("Archive uploading error: {}".format(e))
+            return
+
+        if ftp.send_file(ARCHIVE_NAME, tmp + "/", callback).startswith("2"):
+            return ARCHIVE_PATH + ARCHIVE_NAME
+
+
 # ***************** Picons *******************#
 
 def remove_picons(*, settings, callback, done_callback=None, files_filter=None):
-    with UtfFTP(host=settings.host, user=settings.user, passwd=settings.password) as ftp:
-        ftp.encoding = "utf-8"
+    with FtpPool.get(settings).connection() as ftp:
         callback("FTP OK.\n")
         ftp.delete_picons(callback, settings.picons_path, files_filter)
         if done_callback:
@@ -475,29 +1038,94 @@ def http(user, password, url, callback, use_ssl=False):
         callback("HTTP: {} {}\n".format(message, "Successful." if resp and message else ""))
 
 
-def telnet(host, port=23, user="", password="", timeout=5):
-    try:
-        tn = Telnet(host=host, port=port, timeout=timeout)
-    except socket.timeout:
-        log("telnet error: socket timeout")
-    else:
-        time.sleep(1)
-        command = yield
-        if user != "":
-            tn.read_until(b"login: ", timeout)
-            tn.write(user.encode("utf-8") + b"\n")
-            time.sleep(timeout)
-        if password != "":
-            tn.read_until(b"Password: ", timeout)
-            tn.write(password.encode("utf-8") + b"\n")
-            time.sleep(timeout)
-        tn.write("{}\r\n".format(command).encode("utf-8"))
-        time.sleep(timeout)
-        command = yield
-        time.sleep(timeout)
-        tn.write("{}\r\n".format(command).encode("utf-8"))
-        time.sleep(timeout)
-        yield
+class TelnetSession:
+    """ Telnet session to the receiver shell.
+
+        Instead of fixed delays, the session waits for the login prompts and the shell readiness.
+        Commands are completed by the exit status marker, so the shell prompt format is not important.
+        If no prompt is detected, the timeout is used as a delay.
+    """
+    _INCORRECT = re.compile(rb"incorrect|denied|failed", re.IGNORECASE)
+    _LOGIN = re.compile(rb"login:\s*$", re.IGNORECASE)
+    _PASSWORD = re.compile(rb"password:\s*$", re.IGNORECASE)
+    _PROMPT = re.compile(rb"[#$>]\s*$")
+    _MARKER = "__DE_STATUS_{}__"
+
+    def __init__(self, host, port=23, user="", password="", timeout=5):
+        self._host = host
+        self._port = port
+        self._user = user
+        self._password = password
+        self._timeout = timeout
+        self._tn = None
+        self._count = 0  # To distinguish the output of the timed out commands.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def login(self):
+        """ Opens the session and waits for the shell. Returns the received text.
+
+            Raises TestException if the login is incorrect.
+        """
+        self._tn = Telnet(host=self._host, port=self._port, timeout=self._timeout)
+        patterns = [self._LOGIN, self._PASSWORD, self._PROMPT]
+        text, user_sent, password_sent, text_pos = b"", False, False, 0
+
+        while True:
+            index, match, data = self._tn.expect(patterns, self._timeout)
+            text += data
+            # The banner and MOTD can contain any words, so the text after the password
+            # is checked only if the shell prompt is not received.
+            if password_sent and index != 2 and self._INCORRECT.search(text, text_pos):
+                raise TestException(decode_text(text).strip())
+            if (index == 0 and user_sent) or (index == 1 and password_sent):
+                raise TestException(decode_text(text).strip() or "Login incorrect!")
+            elif index == 0:
+                self.write(self._user)
+                user_sent = True
+            elif index == 1:
+                self.write(self._password)
+                password_sent = True
+                text_pos = len(text)
+            else:
+                if index < 0:
+                    log("Telnet: the shell prompt is not detected.")
+                return decode_text(text)
+
+    def run(self, command, timeout=None):
+        """ Executes the command and returns its exit status and output.
+
+            The status is None if the command is not completed within the timeout or the connection is closed.
+        """
+        self._count += 1
+        marker = self._MARKER.format(self._count)
+        status = re.compile(marker.encode() + rb"(\d+)\r*\n")
+        self.write("{}; echo {}$?".format(command, marker))
+        try:
+            index, match, data = self._tn.expect([status], timeout or self._timeout)
+        except (EOFError, OSError):
+            return None, ""
+
+        lines = decode_text(data[:match.start()] if match else data).splitlines()
+        # Skipping the echo of the command and the previous output.
+        pos = next((i for i, line in enumerate(lines) if marker in line), -1)
+        return int(match.group(1)) if match else None, "\n".join(lines[pos + 1:]).strip()
+
+    def write(self, text):
+        self._tn.write(text.encode("utf-8") + b"\r\n")
+
+    def close(self):
+        if self._tn:
+            self._tn.close()
+            self._tn = None
+
+
+def decode_text(data):
+    return data.decode("utf-8", errors="ignore").replace("\r", "")
 
 
 # ***************** HTTP API *******************#
@@ -719,31 +1347,13 @@ def test_http(host, port, user, password, timeout=5, use_ssl=False, skip_message
 
 def test_telnet(host, port, user, password, timeout=5):
     try:
-        gen = telnet_test(host, port, user, password, timeout)
-        res = next(gen)
-        msg = str(res, encoding="utf8").strip()
-        log(msg)
-        next(gen)
-        if re.search("password", msg, re.IGNORECASE):
-            raise TestException(msg)
-        return msg
-    except (socket.timeout, OSError) as e:
+        with TelnetSession(host, port, user, password, timeout) as tn:
+            msg = tn.login().strip()
+            log(msg)
+            return msg
+    except (socket.timeout, EOFError, OSError) as e:
         raise TestException(e)
 
 
-def telnet_test(host, port, user, password, timeout):
-    tn = Telnet(host=host, port=port, timeout=timeout)
-    time.sleep(1)
-    tn.read_until(b"login: ", timeout=2)
-    tn.write(user.encode("utf-8") + b"\r")
-    time.sleep(timeout)
-    tn.read_until(b"Password: ", timeout=2)
-    tn.write(password.encode("utf-8") + b"\r")
-    time.sleep(timeout)
-    yield tn.read_very_eager()
-    tn.close()
-    yield
-
-
 if __name__ == "__main__":
     pass
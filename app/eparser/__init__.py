@@ -1,18 +1,24 @@
 from app.commons import run_task
 from app.settings import SettingsType
+from .cache import ServicesCache
 from .ecommons import Service, Satellite, Transponder, Bouquet, Bouquets, is_transponder_valid
 from .enigma.blacklist import get_blacklist, write_blacklist
 from .enigma.bouquets import to_bouquet_id, BouquetsWriter, BouquetsReader
 from .enigma.lamedb import get_services as get_enigma_services, write_services as write_enigma_services
-from .iptv import parse_m3u
+from .iptv import parse_m3u, iter_m3u
 from .neutrino.bouquets import get_bouquets as get_neutrino_bouquets, write_bouquets as write_neutrino_bouquets
 from .neutrino.services import get_services as get_neutrino_services, write_services as write_neutrino_services
 from .satxml import get_satellites, write_satellites
 
 
-def get_services(data_path, s_type, format_version):
+def get_services(data_path, s_type, format_version, parallel=False):
     if s_type is SettingsType.ENIGMA_2:
-        return get_enigma_services(data_path, format_version)
+        cache = ServicesCache(data_path, format_version)
+        services = cache.load()
+        if services is None:
+            services = get_enigma_services(data_path, format_version, parallel)
+            cache.dump(services)
+        return services
     elif s_type is SettingsType.NEUTRINO_MP:
         return get_neutrino_services(data_path)
 
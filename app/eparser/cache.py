@@ -0,0 +1,107 @@
+""" Module for caching of the parsed services.
+
+    Parsed lamedb[5] services are stored in a binary file next to the data dir.
+    The cache is keyed by the data path, format version and the size and
+    modification time of the source files and is rebuilt on any change.
+"""
+import os
+import pickle
+
+from app.commons import log
+from app.ui.uicommons import CODED_ICON, LOCKED_ICON, HIDE_ICON
+from .ecommons import Service, write_atomically
+
+_VERSION = 1  # Must be changed when the Service structure or parsing is changed!
+_SUFFIX = ".cache"
+
+
+def pack_services(services):
+    """ Returns services as plain tuples suitable for serialization.
+
+        Icons are replaced by flags.
+    """
+    return [(*s[:2], bool(s.coded), s.service, bool(s.locked), bool(s.hide), *s[6:]) for s in services]
+
+
+def unpack_services(data):
+    """ Restores services from the plain tuples. """
+    return [Service(s[0], s[1], CODED_ICON if s[2] else None, s[3], LOCKED_ICON if s[4] else None,
+                    HIDE_ICON if s[5] else None, *s[6:]) for s in data]
+
+
+class ServicesCache:
+    """ Binary cache of the parsed Enigma2 services. """
+
+    __slots__ = ["_path", "_fmt", "_cache_path", "_key"]
+
+    def __init__(self, path, fmt=4):
+        self._path = path
+        self._fmt = fmt
+        self._cache_path = "{}.{}{}".format(path.rstrip(os.sep), self.file_name, _SUFFIX)
+        self._key = None
+
+    @property
+    def file_name(self):
+        return "lamedb5" if self._fmt == 5 else "lamedb"
+
+    def get_key(self):
+        """ Returns a key of the current state of the source files.
+
+            Returns None if the lamedb file is not found.
+        """
+        stats = []
+        for name in (self.file_name, "blacklist"):
+            try:
+                st = os.stat(self._path + name)
+            except FileNotFoundError:
+                if name == self.file_name:
+                    return
+                stats.append(None)
+            else:
+                stats.append((name, st.st_mtime_ns, st.st_size))
+
+        return _VERSION, self._fmt, os.path.abspath(self._path), tuple(stats)
+
+    def load(self):
+        """ Returns a list of services or None if the cache is missing or out of date. """
+        self._key = self.get_key()
+        if self._key is None:
+            return
+
+        try:
+            with open(self._cache_path, "rb") as file:
+                if pickle.load(file) != self._key:
+                    return
+                services = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log("Services cache loading error: {}".format(e))
+            return
+
+        return unpack_services(services)
+
+    def dump(self, services):
+        """ Stores services for the key obtained with the last load call. """
+        if self._key is None:
+            return
+
+        try:
+            with write_atomically(self._cache_path, "wb") as file:
+                pickle.dump(self._key, file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(pack_services(services), file, pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            log("Services cache writing error: {}".format(e))
+
+    def clear(self):
+        """ Removes the cache file. """
+        try:
+            os.remove(self._cache_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log("Services cache removing error: {}".format(e))
+
+
+if __name__ == "__main__":
+    pass
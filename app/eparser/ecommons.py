@@ -1,12 +1,18 @@
 """ Common elements module """
+import os
 from collections import namedtuple
+from contextlib import contextmanager, suppress
 from enum import Enum
+from functools import lru_cache
 
 Service = namedtuple("Service", ["flags_cas", "transponder_type", "coded", "service", "locked", "hide", "package",
                                  "service_type", "picon", "picon_id", "ssid", "freq", "rate", "pol", "fec",
                                  "system", "pos", "data_id", "fav_id", "transponder"])
 
 
+# Decoded flags line of the Enigma2 service: CAS list, flags value, package name and {"c:XX": value} pids.
+ServiceFlags = namedtuple("ServiceFlags", ["cas", "flags", "package", "pids"])
+
 # ***************** Bouquets *******************#
 
 class BqServiceType(Enum):
@@ -171,6 +177,57 @@ def get_value_by_name(en, name):
             return n.value
 
 
+@lru_cache(maxsize=4096)
+def parse_flags(flags_cas):
+    """ Decodes the flags line of the Enigma2 service.
+
+        Only the first "f:" and "p:" entries are used.
+        The result is cached and must not be modified!
+    """
+    cas, flags, package, pids = [], None, None, {}
+    for f in flags_cas.split(",") if flags_cas else ():
+        prefix = f[:2]
+        if prefix == "C:":
+            cas.append(f)
+        elif prefix == "c:":
+            try:
+                pids[f[:4]] = int(f[4:], 16)
+            except ValueError:
+                pass  # NOP
+        elif prefix == "f:":
+            if flags is None:
+                flags = int(f[2:])
+        elif prefix == "p:":
+            if package is None:
+                package = f[2:]
+
+    return ServiceFlags(tuple(cas), flags or 0, package or "", pids)
+
+
+def escape_xml_attr(value):
+    """ Returns the value escaped for use in the double-quoted XML attribute [as minidom does]. """
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+@contextmanager
+def write_atomically(path, mode="w", **kwargs):
+    """ Opens a temporary file for writing and replaces the file at the given path with it on success.
+
+        On any error the temporary file is removed and the original file stays untouched.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode, **kwargs) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
 def is_transponder_valid(tr: Transponder):
     """ Checks  transponder validity """
     try:
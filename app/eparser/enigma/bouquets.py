@@ -1,6 +1,9 @@
 """ Module for working with Enigma2 bouquets. """
+import os
 import re
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from pathlib import Path
 
 from app.commons import log
@@ -9,6 +12,7 @@ from app.eparser.ecommons import BqServiceType, BouquetService, Bouquets, Bouque
 _TV_FILE = "bouquets.tv"
 _RADIO_FILE = "bouquets.radio"
 _DEFAULT_BOUQUET_NAME = "favourites"
+_BQ_FILES_SUFFIX = (".tv", ".radio")
 
 
 class BouquetsWriter:
@@ -16,6 +20,8 @@ class BouquetsWriter:
 
         If "force_bq_names" then naming the files using the name of the bouquet.
         Some images may have problems displaying the favorites list!
+        Files with unchanged content are not rewritten.
+        Bouquet files [*.tv, *.radio] that are no longer used are removed.
      """
     _SERVICE = '#SERVICE 1:7:{}:0:0:0:0:0:0:0:FROM BOUQUET "userbouquet.{}.{}" ORDER BY bouquet\n'
     _MARKER = "#SERVICE 1:64:{:X}:0:0:0:0:0:0:0::{}\n"
@@ -30,6 +36,7 @@ class BouquetsWriter:
         self._marker_index = 1
         self._space_index = 0
         self._alt_names = set()
+        self._files = set()
 
     def write(self):
         line = []
@@ -56,8 +63,9 @@ class BouquetsWriter:
                 line.append(self._SERVICE.format(2 if bq.type == BqType.RADIO.value else 1, bq_name, bq.type))
                 self.write_bouquet(self._path + "userbouquet.{}.{}".format(bq_name, bq.type), bq.name, bq.services)
 
-            with open(self._path + "bouquets.{}".format(bqs.type), "w", encoding="utf-8") as file:
-                file.writelines(line)
+            self.write_file(self._path + "bouquets.{}".format(bqs.type), line)
+
+        self.remove_unused_files()
 
     def write_bouquet(self, path, name, services):
         """ Writes single bouquet file. """
@@ -95,15 +103,36 @@ class BouquetsWriter:
                 else:
                     bouquet.append("#SERVICE {}\n".format(data))
 
+        self.write_file(path, bouquet)
+
+    def write_file(self, path, lines):
+        """ Writes the file only if its content has changed. """
+        self._files.add(os.path.basename(path))
+        data = "".join(lines)
+        with suppress(OSError, UnicodeDecodeError):
+            with open(path, encoding="utf-8", newline="") as file:
+                if file.read() == data:
+                    return
+
         with open(path, "w", encoding="utf-8") as file:
-            file.writelines(bouquet)
+            file.write(data)
+
+    def remove_unused_files(self):
+        """ Removes bouquet files that were not written by this writer. """
+        for f in filter(lambda f: f.endswith(_BQ_FILES_SUFFIX) and f not in self._files, os.listdir(self._path)):
+            with suppress(OSError):
+                os.remove(os.path.join(self._path, f))
 
 
 class BouquetsReader:
-    """ Class for reading and parsing bouquets. """
+    """ Class for reading and parsing bouquets.
+
+        Bouquet files are read and parsed concurrently.
+    """
     _ALT_PAT = re.compile(".*alternatives\\.+(.*)\\.([tv|radio]+).*")
     _BQ_PAT = re.compile(".*userbouquet\\.+(.*)\\.+[tv|radio].*")
     _STREAM_TYPES = {"4097", "5001", "5002", "8193", "8739"}
+    _MAX_WORKERS = 8  # Max number of the bouquet files read at the same time.
 
     __slots__ = ["_path"]
 
@@ -112,15 +141,18 @@ class BouquetsReader:
 
     def get(self):
         """ Returns a tuple of TV and Radio bouquets. """
-        return self.parse_bouquets(_TV_FILE, BqType.TV.value), self.parse_bouquets(_RADIO_FILE, BqType.RADIO.value)
+        with ThreadPoolExecutor(max_workers=self._MAX_WORKERS) as executor:
+            return (self.parse_bouquets(_TV_FILE, BqType.TV.value, executor),
+                    self.parse_bouquets(_RADIO_FILE, BqType.RADIO.value, executor))
 
-    def parse_bouquets(self, bq_name, bq_type):
+    def parse_bouquets(self, bq_name, bq_type, executor):
         with open(self._path + bq_name, encoding="utf-8", errors="replace") as file:
             lines = file.readlines()
             bouquets = None
             nm_sep = "#NAME"
             b_names = set()
             real_b_names = Counter()
+            bq_files = []  # [bouquets, file name] in declaration order.
 
             for line in lines:
                 if nm_sep in line:
@@ -134,20 +166,21 @@ class BouquetsReader:
                             log("The list of bouquets contains duplicate [{}] names!".format(b_name))
                         else:
                             b_names.add(b_name)
-
-                        rb_name, services = self.get_bouquet(self._path, b_name, bq_type)
-                        if rb_name in real_b_names:
-                            log("Bouquet file 'userbouquet.{}.{}' has duplicate name: {}".format(b_name, bq_type,
-                                                                                                 rb_name))
-                            real_b_names[rb_name] += 1
-                            rb_name = "{} {}".format(rb_name, real_b_names[rb_name])
-                        else:
-                            real_b_names[rb_name] = 0
-
-                        bouquets[2].append(Bouquet(rb_name, bq_type, services, None, None, b_name))
+                        bq_files.append((bouquets, b_name))
                     else:
                         raise ValueError("No bouquet name found for: {}".format(line))
 
+        results = executor.map(lambda b: self.get_bouquet(self._path, b[1], bq_type), bq_files)
+        for (bqs, b_name), (rb_name, services) in zip(bq_files, results):
+            if rb_name in real_b_names:
+                log("Bouquet file 'userbouquet.{}.{}' has duplicate name: {}".format(b_name, bq_type, rb_name))
+                real_b_names[rb_name] += 1
+                rb_name = "{} {}".format(rb_name, real_b_names[rb_name])
+            else:
+                real_b_names[rb_name] = 0
+
+            bqs[2].append(Bouquet(rb_name, bq_type, services, None, None, b_name))
+
         return bouquets
 
     @staticmethod
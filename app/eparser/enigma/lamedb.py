@@ -1,19 +1,31 @@
 """   This module used for parsing and write lamedb file   """
+import os
 import re
+from itertools import islice
+from multiprocessing import Pool
 
 from app.commons import log
 from app.ui.uicommons import CODED_ICON, LOCKED_ICON, HIDE_ICON
 from .blacklist import get_blacklist
-from ..ecommons import Service, POLARIZATION, FEC, SERVICE_TYPE, Flag, T_FEC, TrType, FEC_DEFAULT, T_SYSTEM
+from ..cache import ServicesCache, pack_services, unpack_services
+from ..ecommons import (Service, POLARIZATION, FEC, SERVICE_TYPE, Flag, T_FEC, TrType, FEC_DEFAULT, T_SYSTEM,
+                        parse_flags, write_atomically)
 
 _HEADER = "eDVB services /{}/"
 _SEP = ":"  # separator
 _FILE_NAME = "lamedb"
+_VERSION_PATTERN = re.compile("/[34]/$")
 _END_LINE = "# File was created in DemonEditor.\n# ....Enjoy watching!....\n"
+# Parallel parsing [see tests/bench_lamedb.py].
+# About half of the serial time remains in the main process [reading, results unpickling and restoring],
+# so the parallel path can only pay off with several cores and large files.
+_PARALLEL_MIN_CPUS = 4
+_PARALLEL_MIN_SIZE = 2 * 1024 * 1024  # Smaller files are always parsed in the current process.
+_CHUNK_SIZE = 5000  # Number of services per worker task.
 
 
-def get_services(path, format_version):
-    return LameDbReader(path, format_version).parse()
+def get_services(path, format_version, parallel=False):
+    return LameDbReader(path, format_version, parallel).parse()
 
 
 def write_services(path, services, format_version=4):
@@ -25,59 +37,36 @@ class LameDbReader:
 
         Reads and parses the Enigma2 lamedb[5] file.
         Supports versions 3, 4 and 5..
+        If "parallel" then services of the large files are parsed in worker processes.
     """
-    __slots__ = ["_path", "_fmt"]
+    __slots__ = ["_path", "_fmt", "_parallel"]
 
-    def __init__(self, path, fmt=4):
+    def __init__(self, path, fmt=4, parallel=False):
         self._path = path
         self._fmt = fmt
+        self._parallel = parallel
 
     def parse(self):
         """ Parsing lamedb. """
         if self._fmt == 4:
-            return self.parse_v4()
+            return list(self.parse_v4())
         elif self._fmt == 5:
             return self.parse_v5()
         raise SyntaxError("Unsupported version of the format.")
 
-    def parse_v3(self, services, transponders):
-        """ Parsing version 3. """
-        for t in transponders:
-            tr = transponders[t].lower()
-            tr_type = tr[0:1]
-            if tr_type == "c":
-                tr += ":0:0:0"
-            elif tr_type == "t":
-                tr += ":0:0"
-            else:
-                tr_data = tr.split(_SEP)
-                len_data = len(tr_data)
-                if len_data == 6:
-                    tr_data.append("0")
-                elif len_data == 9:
-                    tr_data.insert(6, "0")
-                    tr_data.append("0")
-                    tr_data.append("2")
-
-                tr = _SEP.join(tr_data)
-
-            transponders[t] = tr
-
-        return self.parse_services(services, transponders)
-
     def parse_v4(self):
-        """ Parsing version 4. """
+        """ Parsing version 4.
+
+            Reads the file line by line and yields services as they are parsed.
+        """
         with open(self._path + _FILE_NAME, "r", encoding="utf-8", errors="replace") as file:
-            try:
-                data = str(file.read())
-            except UnicodeDecodeError as e:
-                log("lamedb parse error: " + str(e))
-            else:
-                return self.get_services_list(data)
+            self._parallel = self.is_parallel(file)
+            yield from self.parse_lines(file)
 
     def parse_v5(self):
         """ Parsing version 5. """
         with open(self._path + "lamedb5", "r", encoding="utf-8", errors="replace") as file:
+            self._parallel = self.is_parallel(file)
             lns = file.readlines()
 
             if lns and not lns[0].endswith("/5/\n"):
@@ -100,15 +89,81 @@ class LameDbReader:
 
             return self.parse_services(srvs, trs)
 
+    def parse_lines(self, lines):
+        """ Generates services from the lines of the lamedb [v.3, v.4].
+
+            Only the transponders section is held in memory.
+        """
+        lines = (ln.rstrip("\n") for ln in lines)
+        match = re.search(_VERSION_PATTERN, next(lines, ""))
+        if not match:
+            msg = "lamedb parsing error: unsupported format."
+            log(msg)
+            raise SyntaxError(msg)
+
+        is_v3 = match.group() == "/3/"
+        transponders = {}
+        tr_id = None
+        # Transponders.
+        for line in lines:
+            if line == "end":
+                break
+            elif line.startswith("\t"):
+                if tr_id:
+                    transponders[tr_id] = self.to_v4_transponder(line[1:]) if is_v3 else line[1:]
+                tr_id = None
+            elif line not in ("/", "transponders"):
+                tr_id = line
+        # Services.
+        if next(lines, "end") == "end":
+            return
+
+        if self._parallel:
+            yield from self.get_services_parallel(self.get_records(lines), transponders)
+        else:
+            yield from self.get_services(self.get_records(lines), transponders)
+
     def parse_services(self, services, transponders):
         """ Parsing services. """
-        services_list = []
-        blacklist = get_blacklist(self._path) if self._path else {}
         srvs = self.split(services, 3)
         if srvs[0][0] == "":  # Remove first empty element.
             srvs.remove(srvs[0])
 
-        for srv in srvs:
+        if self._parallel:
+            return list(self.get_services_parallel(srvs, transponders))
+        return list(self.get_services(srvs, transponders))
+
+    def is_parallel(self, file):
+        """ Checks if the parallel parsing is enabled and makes sense for the given file. """
+        if not self._parallel or (os.cpu_count() or 1) < _PARALLEL_MIN_CPUS:
+            return False
+        return os.fstat(file.fileno()).st_size >= _PARALLEL_MIN_SIZE
+
+    def get_services_parallel(self, services, transponders):
+        """ Generates services by parsing chunks of the records in worker processes.
+
+            The transponders and the blacklist are passed to each worker once [by the pool initializer].
+            The order of the services is preserved.
+        """
+        services = iter(services)
+        chunks = iter(lambda: list(islice(services, _CHUNK_SIZE)), [])
+        blacklist = get_blacklist(self._path) if self._path else {}
+
+        with Pool(initializer=_init_worker, initargs=(self._path, transponders, blacklist)) as pool:
+            for data in pool.imap(_parse_chunk, chunks):
+                yield from unpack_services(data)
+
+    def get_services(self, services, transponders, blacklist=None):
+        """ Generates services from the [data id, name, flags] records.
+
+            Each transponder is parsed and formatted only once.
+            Services of the same transponder share its data.
+        """
+        if blacklist is None:
+            blacklist = get_blacklist(self._path) if self._path else {}
+        tr_table = {}
+
+        for srv in services:
             data_id = str(srv[0]).lower()  # Lower is for lamedb ver.3.
             data = data_id.split(_SEP)
             sp = "0"
@@ -128,10 +183,17 @@ class LameDbReader:
                 data[0] = "{:0>4}".format(data[0])
                 data_id = _SEP.join(data)
 
-            srv_type = int(data[4])
             transponder_id = "{}:{}:{}".format(data[1], tid, nid)
-            transponder = transponders.get(transponder_id, None)
-
+            tr = tr_table.get(transponder_id, None)
+            if tr is None:
+                transponder = transponders.get(transponder_id, None)
+                if transponder is None:
+                    continue
+                tr = self.parse_transponder(transponder)
+                tr_table[transponder_id] = tr
+
+            tr_type, freq, rate, pol, fec, system, pos, transponder = tr
+            srv_type = int(data[4])
             tid = tid.lstrip(sp).upper()
             nid = nid.lstrip(sp).upper()
             ssid = str(data[0]).lstrip(sp).upper()
@@ -141,110 +203,116 @@ class LameDbReader:
             picon_id = "1_0_{:X}_{}_{}_{}_{}_0_0_0.png".format(srv_type, ssid, tid, nid, onid)
             s_id = "1:0:{:X}:{}:{}:{}:{}:0:0:0:".format(srv_type, ssid, tid, nid, onid)
 
-            all_flags = srv[2].split(",")
-            coded = CODED_ICON if list(filter(lambda x: x.startswith("C:"), all_flags)) else None
-            flags = list(filter(lambda x: x.startswith("f:"), all_flags))
-            hide = HIDE_ICON if flags and Flag.is_hide(int(flags[0][2:])) else None
+            flags = parse_flags(srv[2])
+            coded = CODED_ICON if flags.cas else None
+            hide = HIDE_ICON if Flag.is_hide(flags.flags) else None
             locked = LOCKED_ICON if s_id in blacklist else None
+            service_type = SERVICE_TYPE.get(data[4], SERVICE_TYPE["-2"])
+            # Removing all non printable symbols!
+            srv_name = srv[1] if srv[1].isprintable() else "".join(c for c in srv[1] if c.isprintable())
 
-            package = list(filter(lambda x: x.startswith("p:"), all_flags))
-            package = package[0][2:] if package else ""
-
-            if transponder is not None:
-                tr_type, sp, tr = str(transponder).partition(" ")
-                tr_type = TrType(tr_type)
-                tr = tr.split(_SEP)
-                service_type = SERVICE_TYPE.get(data[4], SERVICE_TYPE["-2"])
-                # Removing all non printable symbols!
-                srv_name = "".join(c for c in srv[1] if c.isprintable())
-                freq = tr[0]
-                rate = tr[1]
-                pol = None
-                fec = None
-                system = None
-                pos = None
-
-                if tr_type is TrType.Satellite:
-                    pol = POLARIZATION.get(tr[2], None)
-                    fec = FEC.get(tr[3], None)
-                    system = "DVB-S2" if len(tr) > 7 else "DVB-S"
-                    pos = tr[4]
-                if tr_type is TrType.Terrestrial:
-                    system = T_SYSTEM.get(tr[9], None)
-                    pos = "T"
-                    fec = T_FEC.get(tr[3], None)
-                elif tr_type is TrType.Cable:
-                    system = "DVB-C"
-                    pos = "C"
-                    fec = FEC_DEFAULT.get(tr[4])
-
-                # Formatting displayed values.
-                try:
-                    freq = "{}".format(int(freq) // 1000)
-                    rate = "{}".format(int(rate) // 1000)
-                    if tr_type is TrType.Satellite:
-                        pos = int(pos)
-                        pos = "{:0.1f}{}".format(abs(pos / 10), "W" if pos < 0 else "E")
-                except ValueError as e:
-                    log("Parse error [parse_services]: {}".format(e))
-
-                s = Service(srv[2], tr_type.value, coded, srv_name, locked, hide, package, service_type, None,
-                            picon_id, data[0], freq, rate, pol, fec, system, pos, data_id, fav_id, transponder)
-
-                services_list.append(s)
-        return services_list
+            yield Service(srv[2], tr_type, coded, srv_name, locked, hide, flags.package, service_type, None,
+                          picon_id, data[0], freq, rate, pol, fec, system, pos, data_id, fav_id, transponder)
 
-    def get_services_list(self, data):
-        """ Returns a list of services from a string data representation. """
-        transponders, sep, services = data.partition("transponders")  # 1 step
-        pattern = re.compile("/[34]/$")
-        match = re.search(pattern, transponders)
-        if not match:
-            msg = "lamedb parsing error: unsupported format."
-            log(msg)
-            raise SyntaxError(msg)
-
-        transponders, sep, services = services.partition("services")  # 2 step
-        services, sep, _ = services.partition("\nend")  # 3 step
+    @staticmethod
+    def parse_transponder(transponder):
+        """ Returns the displayed values of the transponder.
+
+            [type, freq, rate, pol, fec, system, pos, transponder]
+        """
+        tr_type, sp, tr = str(transponder).partition(" ")
+        tr_type = TrType(tr_type)
+        tr = tr.split(_SEP)
+        freq = tr[0]
+        rate = tr[1]
+        pol = None
+        fec = None
+        system = None
+        pos = None
+
+        if tr_type is TrType.Satellite:
+            pol = POLARIZATION.get(tr[2], None)
+            fec = FEC.get(tr[3], None)
+            system = "DVB-S2" if len(tr) > 7 else "DVB-S"
+            pos = tr[4]
+        if tr_type is TrType.Terrestrial:
+            system = T_SYSTEM.get(tr[9], None)
+            pos = "T"
+            fec = T_FEC.get(tr[3], None)
+        elif tr_type is TrType.Cable:
+            system = "DVB-C"
+            pos = "C"
+            fec = FEC_DEFAULT.get(tr[4])
+
+        # Formatting displayed values.
+        try:
+            freq = "{}".format(int(freq) // 1000)
+            rate = "{}".format(int(rate) // 1000)
+            if tr_type is TrType.Satellite:
+                pos = int(pos)
+                pos = "{:0.1f}{}".format(abs(pos / 10), "W" if pos < 0 else "E")
+        except ValueError as e:
+            log("Parse error [parse_services]: {}".format(e))
+
+        return tr_type.value, freq, rate, pol, fec, system, pos, transponder
 
-        if match.group() == "/3/":
-            return self.parse_v3(services.split("\n"), self.parse_transponders(transponders.split("/")))
+    @staticmethod
+    def get_records(lines):
+        """ Generates [data id, name, flags] records up to the end of the services section. """
+        for data_id in lines:
+            if data_id == "end":
+                break
+            yield data_id, next(lines, ""), next(lines, "")
 
-        return self.parse_services(services.split("\n"), self.parse_transponders(transponders.split("/")))
+    def get_services_list(self, data):
+        """ Returns a list of services from a string data representation. """
+        return list(self.parse_lines(data.split("\n")))
 
     @staticmethod
     def get_services_lines(services):
-        """ Returns a list of strings from services for lamedb [v.4]. """
-        lines = [_HEADER.format(4), "\ntransponders\n"]
-        tr_lines = []
-        services_lines = ["end\nservices\n"]
-        tr_set = set()
+        """ Generates strings from services for lamedb [v.4].
+
+            Services are iterated twice, so any iterable is materialized first.
+        """
+        services = list(services)
+        tr_lines = {}
         for srv in services:
             data_id = str(srv.data_id).split(_SEP)
             tr_id = "{}:{}:{}".format(data_id[1], data_id[2], data_id[3])
-            if tr_id not in tr_set:
-                transponder = "{}\n\t{}\n/\n".format(tr_id, srv.transponder)
-                tr_lines.append(transponder)
-                tr_set.add(tr_id)
-            # Services
-            services_lines.append("{}\n{}\n{}\n".format(srv.data_id, srv.service, srv.flags_cas))
-
-        tr_lines.sort()
-        lines.extend(tr_lines)
-        lines.extend(services_lines)
-        lines.append("end\n" + _END_LINE)
-
-        return lines
-
-    def parse_transponders(self, arg):
-        """ Parsing transponders. """
-        transponders = {}
-        for ar in arg:
-            tr = ar.replace("\n", "").split("\t")
-            if len(tr) == 2:
-                transponders[tr[0]] = tr[1]
+            if tr_id not in tr_lines:
+                tr_lines[tr_id] = "{}\n\t{}\n/\n".format(tr_id, srv.transponder)
+
+        yield _HEADER.format(4)
+        yield "\ntransponders\n"
+        yield from sorted(tr_lines.values())
+        yield "end\nservices\n"
+        # Services
+        for srv in services:
+            yield "{}\n{}\n{}\n".format(srv.data_id, srv.service, srv.flags_cas)
+        yield "end\n" + _END_LINE
 
-        return transponders
+    @staticmethod
+    def to_v4_transponder(transponder):
+        """ Converts transponder data of the lamedb ver.3 to ver.4. """
+        tr = transponder.lower()
+        tr_type = tr[0:1]
+        if tr_type == "c":
+            tr += ":0:0:0"
+        elif tr_type == "t":
+            tr += ":0:0"
+        else:
+            tr_data = tr.split(_SEP)
+            len_data = len(tr_data)
+            if len_data == 6:
+                tr_data.append("0")
+            elif len_data == 9:
+                tr_data.insert(6, "0")
+                tr_data.append("0")
+                tr_data.append("2")
+
+            tr = _SEP.join(tr_data)
+
+        return tr
 
     def split(self, itr, size):
         """ Divide the iterable. """
@@ -259,6 +327,21 @@ class LameDbReader:
         return srv
 
 
+# Parsing data of the worker process. Set by the pool initializer.
+_worker_data = None
+
+
+def _init_worker(path, transponders, blacklist):
+    global _worker_data
+    _worker_data = LameDbReader(path), transponders, blacklist
+
+
+def _parse_chunk(services):
+    """ Parses a chunk of the service records in the worker process. """
+    reader, transponders, blacklist = _worker_data
+    return pack_services(reader.get_services(services, transponders, blacklist))
+
+
 class LameDbWriter:
     """ Writes the Enigma2 lamedb[5] file.
 
@@ -269,38 +352,38 @@ class LameDbWriter:
     def __init__(self, path, services, fmt=4):
         self._path = path
         self._fmt = fmt
-        self._services = services
+        self._services = list(services)  # Iterated twice for transponders and services.
 
     def write(self):
+        """ Writes the file via a temporary one to avoid a truncated file on errors. """
+        ServicesCache(self._path, self._fmt).clear()
+
         if self._fmt == 4:
             # Writing lamedb file ver.4
-            with open(self._path + _FILE_NAME, "w") as file:
+            with write_atomically(self._path + _FILE_NAME) as file:
                 file.writelines(LameDbReader.get_services_lines(self._services))
         elif self._fmt == 5:
-            self.write_to_lamedb5()
+            with write_atomically(self._path + "lamedb5") as file:
+                file.writelines(self.get_lamedb5_lines())
 
-    def write_to_lamedb5(self):
-        """ Writing lamedb5 file. """
-        lines = [_HEADER.format(5) + "\n"]
-        services_lines = []
+    def get_lamedb5_lines(self):
+        """ Generates lamedb5 file lines. """
         tr_set = set()
-
         for srv in self._services:
             data_id = str(srv.data_id).split(_SEP)
             tr_id = "{}:{}:{}".format(data_id[1], data_id[2], data_id[3])
             tr_set.add("t:{},{}\n".format(tr_id, srv.transponder.replace(" ", ":", 1)))
+
+        yield _HEADER.format(5) + "\n"
+        yield from sorted(tr_set)
+
+        for srv in self._services:
             # Removing empty packages
-            flags = list(filter(lambda x: x != "p:", srv.flags_cas.split(",")))
-            flags = ",".join(flags)
+            flags = ",".join(f for f in srv.flags_cas.split(",") if f != "p:")
             flags = "," + flags if flags else ""
-            services_lines.append("s:{},\"{}\"{}\n".format(srv.data_id, srv.service, flags))
-
-        lines.extend(sorted(tr_set))
-        lines.extend(services_lines)
-        lines.append(_END_LINE)
+            yield "s:{},\"{}\"{}\n".format(srv.data_id, srv.service, flags)
 
-        with open(self._path + "lamedb5", "w") as file:
-            file.writelines(lines)
+        yield _END_LINE
 
 
 if __name__ == "__main__":
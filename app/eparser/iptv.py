@@ -1,5 +1,7 @@
 """ Module for IPTV and streams support """
+import codecs
 import re
+from itertools import chain
 from enum import Enum
 from urllib.parse import unquote, quote
 
@@ -12,6 +14,7 @@ from app.ui.uicommons import IPTV_ICON
 NEUTRINO_FAV_ID_FORMAT = "{}::{}::{}::{}::{}::{}::{}::{}::{}::{}"
 ENIGMA2_FAV_ID_FORMAT = " {}:0:{}:{:X}:{:X}:{:X}:{:X}:0:0:0:{}:{}\n#DESCRIPTION: {}\n"
 MARKER_FORMAT = " 1:64:{}:0:0:0:0:0:0:0::{}\n#DESCRIPTION {}\n"
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
 
 
 class StreamType(Enum):
@@ -24,19 +27,17 @@ class StreamType(Enum):
 
 
 def parse_m3u(path, s_type, detect_encoding=True, params=None):
-    with open(path, "rb") as file:
-        data = file.read()
-        encoding = "utf-8"
-
-        if detect_encoding:
-            try:
-                import chardet
-            except ModuleNotFoundError:
-                pass
-            else:
-                enc = chardet.detect(data)
-                encoding = enc.get("encoding", "utf-8")
+    return list(chain.from_iterable(iter_m3u(path, s_type, detect_encoding, params)))
+
+
+def iter_m3u(path, s_type, detect_encoding=True, params=None, batch_size=1000):
+    """ Returns a generator of the lists [batches] of services from the *.m3u* file.
 
+        The file is decoded while reading. Undecodable bytes are replaced, not skipped.
+    """
+    encoding = get_m3u_encoding(path) if detect_encoding else "utf-8"
+
+    with open(path, "r", encoding=encoding, errors="replace") as file:
         aggr = [None] * 10
         s_aggr = aggr[: -3]
         services = []
@@ -49,7 +50,8 @@ def parse_m3u(path, s_type, detect_encoding=True, params=None):
         st = BqServiceType.IPTV.name
         params = params or [0, 0, 0, 0]
 
-        for line in str(data, encoding=encoding, errors="ignore").splitlines():
+        for line in file:
+            line = line.rstrip("\r\n")
             if line.startswith("#EXTINF"):
                 inf, sep, line = line.partition(" ")
                 if not line:
@@ -89,30 +91,143 @@ def parse_m3u(path, s_type, detect_encoding=True, params=None):
                 else:
                     log("*.m3u* parse error ['{}']: name[{}], url[{}], fav id[{}]".format(path, name, url, fav_id))
 
-    return services
+            if len(services) >= batch_size:
+                yield services
+                services = []
+
+        if services:
+            yield services
+
+
+def get_m3u_encoding(path, size=64 * 1024):
+    """ Returns the encoding of the file.
+
+        The whole file is checked as UTF-8 first [read by parts of the given size].
+        Otherwise, the encoding is detected by chardet from the lines with non-ASCII characters.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as file:
+        try:
+            for data in iter(lambda: file.read(size), b""):
+                decoder.decode(data)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            pass
+        else:
+            return "utf-8-sig"  # Also skips BOM.
+
+        try:
+            import chardet
+        except ModuleNotFoundError:
+            return "utf-8"
+
+        # Only lines with non-ASCII characters are used for detection.
+        file.seek(0)
+        data = bytearray()
+        for line in file:
+            if _NON_ASCII.search(line):
+                data.extend(line)
+                if len(data) >= size:
+                    break
+        result = chardet.detect(bytes(data))
+
+    # UTF-8 is already known to be invalid, so even a low-confidence result is better.
+    encoding = result.get("encoding", None)
+    if not encoding or encoding.lower() == "ascii":
+        return "utf-8"
+
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return "utf-8"
+    return encoding
 
 
 def export_to_m3u(path, bouquet, s_type):
-    pattern = re.compile(".*:(http.*):.*") if s_type is SettingsType.ENIGMA_2 else re.compile("(http.*?)::::.*")
-    lines = ["#EXTM3U\n"]
-    current_grp = None
-
-    for s in bouquet.services:
-        s_type = s.type
-        if s_type is BqServiceType.IPTV:
-            res = re.match(pattern, s.data)
-            if not res:
+    export_bouquets_to_m3u(path, (bouquet,), s_type)
+
+
+def export_bouquets_to_m3u(path, bouquets, s_type, file_name=None):
+    """ Exports bouquets to the *.m3u files.
+
+        Each bouquet is written to its own file [path + bouquet name + .m3u].
+        If the file name is set, all bouquets are written to one file. Services are grouped by bouquet names and markers.
+        Returns the number of exported streams.
+    """
+    count = 0
+    if file_name:
+        with open(path + file_name, "w", encoding="utf-8") as file:
+            file.write("#EXTM3U\n")
+            for bq in bouquets:
+                count += write_m3u_services(file, bq.services, s_type, bq.name)
+    else:
+        for bq in bouquets:
+            with open(path + "{}.m3u".format(bq.name), "w", encoding="utf-8") as file:
+                file.write("#EXTM3U\n")
+                count += write_m3u_services(file, bq.services, s_type)
+
+    return count
+
+
+def write_m3u_services(file, services, s_type, group=None):
+    count = 0
+    current_grp = "#EXTGRP:{}\n".format(group) if group else None
+
+    for s in services:
+        srv_type = s.type
+        if srv_type is BqServiceType.IPTV:
+            url = get_url(s.data, s_type)
+            if not url:
                 continue
-            data = res.group(1)
-            lines.append("#EXTINF:-1,{}\n".format(s.name))
-            if current_grp:
-                lines.append(current_grp)
-            lines.append("{}\n".format(unquote(data.strip())))
-        elif s_type is BqServiceType.MARKER:
+            file.write("#EXTINF:-1,{}\n{}{}\n".format(s.name, current_grp or "", unquote(url.strip())))
+            count += 1
+        elif srv_type is BqServiceType.MARKER:
             current_grp = "#EXTGRP:{}\n".format(s.name)
 
-    with open(path + "{}.m3u".format(bouquet.name), "w", encoding="utf-8") as file:
-        file.writelines(lines)
+    return count
+
+
+def get_url(fav_id, s_type):
+    """ Returns the [http] stream url from the fav id or None. """
+    if s_type is SettingsType.ENIGMA_2:
+        data = fav_id.partition("\n")[0].split(":", 10)
+        if len(data) < 11:
+            return
+        # The url is quoted and followed by the name.
+        url, sep, name = data[10].partition(":")
+        if name.startswith("//"):
+            url = data[10].rpartition(":")[0]  # Not quoted url.
+    else:
+        url = fav_id.partition("::")[0]
+
+    return url if url.startswith("http") else None
+
+
+def get_renumbered_fav_ids(fav_ids, stream_type=None, srv_type="1", tid="0", nid="0", namespace="0", sid_auto=False):
+    """ Returns a list of the Enigma2 IPTV fav ids with the new reference values.
+
+        If the stream type is not set, only the default values [1:0:0:0:0] are set
+        for the service type, sid, tid, nid and namespace.
+        Values must be in the hex format. Fav ids with unknown format are returned unchanged.
+    """
+    if stream_type:
+        fmt = "{}:{{}}:{}:{{}}:{}:{}:{}:{{}}".format(stream_type, srv_type, tid, nid, namespace)
+    else:
+        fmt = "{}:{}:1:0:0:0:0:{}"
+
+    new_ids = []
+    append = new_ids.append
+    for index, fav_id in enumerate(fav_ids):
+        data, sep, desc = fav_id.partition("http")
+        data = data.split(":", 7)
+        if len(data) < 8:
+            append(fav_id)
+        elif stream_type:
+            append("{}{}{}".format(fmt.format(data[1], "{:X}".format(index) if sid_auto else "0", data[7]), sep, desc))
+        else:
+            append("{}{}{}".format(fmt.format(data[0], data[1], data[7]), sep, desc))
+
+    return new_ids
 
 
 def get_fav_id(url, service_name, settings_type, params=None, stream_type=None, s_type=1):
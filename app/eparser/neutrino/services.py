@@ -1,119 +1,104 @@
-from xml.dom.minidom import parse, Document
+from xml.etree.ElementTree import iterparse
 
 from app.commons import log
-from ..ecommons import Service, POLARIZATION, FEC, SYSTEM, SERVICE_TYPE, PROVIDER
+from ..ecommons import Service, POLARIZATION, FEC, SYSTEM, SERVICE_TYPE, PROVIDER, escape_xml_attr, write_atomically
 
 _FILE = "services.xml"
 _TR_ATTR_NAMES = ("id", "on", "frq", "inv", "sr", "fec", "pol", "mod", "sys")  # transponder attributes
 _SRV_ATTR_NAMES = ("t", "s", "num", "f", "v", "a", "p", "pmt", "tx", "vt")  # service attributes
+_COMMENT = " File was created in DemonEditor. Enjoy watching! "
 
 
 def write_services(path, services):
-    doc = Document()
-    root = doc.createElement("zapit")
-    root.setAttribute("api", "4")
-    doc.appendChild(root)
-    comment = doc.createComment(" File was created in DemonEditor. Enjoy watching! ")
-    doc.appendChild(comment)
-
+    """ Writes services to the xml file element by element. """
     sats = {}
     for srv in services:
-        flag = srv[0]
-        if flag in sats:
-            sats.get(flag).append(srv)
-        else:
-            srv_list = [srv]
-            sats[flag] = srv_list
-
-    for sat in sats:
-        tr_atr = sat.split(":")
-        sat_elem = doc.createElement("sat")
-        sat_elem.setAttribute("name", tr_atr[0])
-        sat_elem.setAttribute("position", tr_atr[1])
-        sat_elem.setAttribute("diseqc", tr_atr[2])
-        sat_elem.setAttribute("uncommited", tr_atr[3])
-        root.appendChild(sat_elem)
-
-        transponers = {}
-        for srv in sats.get(sat):
-            flag = srv[-1]
-            if flag in transponers:
-                transponers.get(flag).append(srv)
-            else:
-                srv_list = [srv]
-                transponers[flag] = srv_list
-
-        for tr in transponers:
-            tr_elem = doc.createElement("TS")
-            tr_atr = tr.split(":")
-            for i, value in enumerate(tr_atr):
-                if value == "None":
-                    continue
-                tr_elem.setAttribute(_TR_ATTR_NAMES[i], value)
-            sat_elem.appendChild(tr_elem)
-
-            for srv in transponers.get(tr):
-                srv_elem = doc.createElement("S")
-                srv_elem.setAttribute("i", srv.ssid)
-                srv_elem.setAttribute("n", srv.service)
-
-                srv_attrs = srv.data_id.split(":")
-                api = srv_attrs.pop(0)
-
-                if api == "3":
-                    root.setAttribute("api", "3")  # !!!
-                for i, value in enumerate(srv_attrs):
-                    if value == "None":
-                        continue
-                    srv_elem.setAttribute(_SRV_ATTR_NAMES[i], value)
-
-                tr_elem.appendChild(srv_elem)
-
-    doc.writexml(open(path + _FILE, "w"), addindent="    ", newl="\n", encoding="UTF-8")
-    doc.unlink()
+        sats.setdefault(srv[0], []).append(srv)
+
+    api = "3" if any(srv.data_id.startswith("3:") for srv in services) else "4"
+
+    with write_atomically(path + _FILE, encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<zapit api="{}"{}>\n'.format(api, "" if sats else "/"))
+
+        for sat in sats:
+            tr_atr = sat.split(":")
+            file.write('    <sat name="{}" position="{}" diseqc="{}" uncommited="{}">\n'.format(
+                *map(escape_xml_attr, tr_atr[:4])))
+
+            transponders = {}
+            for srv in sats.get(sat):
+                transponders.setdefault(srv[-1], []).append(srv)
+
+            for tr in transponders:
+                file.write("        <TS{}>\n".format(get_attrs(tr.split(":"), _TR_ATTR_NAMES)))
+                for srv in transponders.get(tr):
+                    attrs = get_attrs(srv.data_id.split(":")[1:], _SRV_ATTR_NAMES)
+                    file.write('            <S i="{}" n="{}"{}/>\n'.format(escape_xml_attr(srv.ssid),
+                                                                            escape_xml_attr(srv.service), attrs))
+                file.write("        </TS>\n")
+            file.write("    </sat>\n")
+
+        if sats:
+            file.write("</zapit>\n")
+        file.write("<!--{}-->\n".format(_COMMENT))
+
+
+def get_attrs(values, names):
+    """ Returns a string of the xml attributes. "None" values are skipped. """
+    return "".join(' {}="{}"'.format(names[i], escape_xml_attr(v)) for i, v in enumerate(values) if v != "None")
 
 
 def get_services(path):
-    return parse_services(path)
+    return list(parse_services(path))
 
 
 def parse_services(path):
-    """ Parsing services from xml"""
-    dom = parse(path + _FILE)
-    services = []
-
-    for root in dom.getElementsByTagName("zapit"):
-        api = root.attributes["api"].value
-
-        for elem in root.getElementsByTagName("sat"):
-            if elem.hasAttributes():
-                sat_name = elem.attributes["name"].value
-                sat_pos = elem.attributes["position"].value
-                diseqc = elem.attributes.get("diseqc")
-                diseqc = diseqc.value if diseqc else diseqc
-                uncommited = elem.attributes.get("uncommited")
-                uncommited = uncommited.value if uncommited else uncommited
-                sat = "{}:{}:{}:{}".format(sat_name, sat_pos, diseqc, uncommited)
-
-                for tr_elem in elem.getElementsByTagName("TS"):
-                    if tr_elem.hasAttributes():
-                        parse_transponder(api, sat, sat_pos, services, tr_elem)
-
-        return services
-
-
-def parse_transponder(api, sat, sat_pos, services, tr_elem):
-    tr_id = tr_elem.attributes["id"].value
-    on = tr_elem.attributes["on"].value
-    freq = tr_elem.attributes["frq"].value
-    rate = tr_elem.attributes["sr"].value
-    inv = tr_elem.attributes["inv"].value
-    fec = tr_elem.attributes["fec"].value
-    pol = tr_elem.attributes["pol"].value
-    mod = tr_elem.attributes.get("mod")
-    mod = mod.value if mod else mod
-    sys = tr_elem.attributes.get("sys")
-    sys = sys.value if sys else sys
+    """ Parsing services from xml.
+
+        Services are generated while reading the file.
+        Processed elements are cleared to keep memory usage low.
+    """
+    api, sat, sat_pos, tr = None, None, None, None
+    root = None
+
+    for event, elem in iterparse(path + _FILE, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "zapit":
+                root = elem
+                api = elem.attrib["api"]
+            elif tag == "sat":
+                sat, sat_pos = None, None
+                if elem.attrib:
+                    sat_pos = elem.attrib["position"]
+                    sat = "{}:{}:{}:{}".format(elem.attrib["name"], sat_pos, elem.attrib.get("diseqc"),
+                                               elem.attrib.get("uncommited"))
+            elif tag == "TS":
+                tr = parse_transponder(sat_pos, elem) if sat and elem.attrib else None
+        elif tag == "S":
+            if tr and elem.attrib:
+                yield get_service(api, sat, tr, elem)
+        elif tag == "TS":
+            tr = None
+            elem.clear()
+        elif tag == "sat":
+            sat = None
+            root.clear()
+
+
+def parse_transponder(sat_pos, tr_elem):
+    """ Returns the transponder data and displayed values. """
+    attrs = tr_elem.attrib
+    tr_id = attrs["id"]
+    on = attrs["on"]
+    freq = attrs["frq"]
+    rate = attrs["sr"]
+    inv = attrs["inv"]
+    fec = attrs["fec"]
+    pol = attrs["pol"]
+    mod = attrs.get("mod")
+    sys = attrs.get("sys")
 
     tr = "{}:{}:{}:{}:{}:{}:{}:{}:{}".format(tr_id, on, freq, inv, rate, fec, pol, mod, sys)
     tr_id = tr_id.lstrip("0")
@@ -127,34 +112,35 @@ def parse_transponder(api, sat, sat_pos, services, tr_elem):
     except ValueError as e:
         log("Neutrino parsing error [parse_transponder]: {}".format(e))
 
-    for srv_elem in tr_elem.getElementsByTagName("S"):
-        if srv_elem.hasAttributes():
-            ssid = srv_elem.attributes["i"].value
-            name = srv_elem.attributes["n"].value
-            srv_type = srv_elem.attributes["t"].value
-            sys = srv_elem.attributes["s"].value
-            num = srv_elem.attributes.get("num")
-            num = num.value if num else num
-            f = srv_elem.attributes.get("f")
-            f = f.value if f else f
-            v, a, p, pmt, tx, vt = [None] * 6
-            # For v3 is possible so: '<S i="0001" n="name" t="1" s="0" num="770" f="4"/>' (equals v4 api)
-            if api == "3" and len(srv_elem.attributes) > 6:
-                v = srv_elem.attributes["v"].value
-                a = srv_elem.attributes["a"].value
-                p = srv_elem.attributes["p"].value
-                pmt = srv_elem.attributes["pmt"].value
-                tx = srv_elem.attributes["tx"].value
-                vt = srv_elem.attributes["vt"].value
-
-            data_id = "{}:{}:{}:{}:{}:{}:{}:{}:{}:{}:{}".format(api, srv_type, sys, num, f, v, a, p, pmt, tx, vt)
-            fav_id = "{}:{}:{}".format(tr_id, on.lstrip("0"), ssid.lstrip("0"))
-            picon_id = "{}{}{}.png".format(tr_id, on, ssid)
-            prv, st, = PROVIDER.get(int(on, 16)), SERVICE_TYPE.get(str(int(srv_type, 16)), SERVICE_TYPE.get("-2"))
-
-            srv = Service(sat, None, None, name, None, None, prv, st, None, picon_id, ssid, freq, rate, pol,
-                          FEC.get(fec), SYSTEM.get(sys), sat_pos, data_id, fav_id, tr)
-            services.append(srv)
+    return tr, tr_id, on, freq, rate, pol, FEC.get(fec), sat_pos
+
+
+def get_service(api, sat, transponder, srv_elem):
+    tr, tr_id, on, freq, rate, pol, fec, sat_pos = transponder
+    attrs = srv_elem.attrib
+    ssid = attrs["i"]
+    name = attrs["n"]
+    srv_type = attrs["t"]
+    sys = attrs["s"]
+    num = attrs.get("num")
+    f = attrs.get("f")
+    v, a, p, pmt, tx, vt = [None] * 6
+    # For v3 is possible so: '<S i="0001" n="name" t="1" s="0" num="770" f="4"/>' (equals v4 api)
+    if api == "3" and len(attrs) > 6:
+        v = attrs["v"]
+        a = attrs["a"]
+        p = attrs["p"]
+        pmt = attrs["pmt"]
+        tx = attrs["tx"]
+        vt = attrs["vt"]
+
+    data_id = "{}:{}:{}:{}:{}:{}:{}:{}:{}:{}:{}".format(api, srv_type, sys, num, f, v, a, p, pmt, tx, vt)
+    fav_id = "{}:{}:{}".format(tr_id, on.lstrip("0"), ssid.lstrip("0"))
+    picon_id = "{}{}{}.png".format(tr_id, on, ssid)
+    prv, st, = PROVIDER.get(int(on, 16)), SERVICE_TYPE.get(str(int(srv_type, 16)), SERVICE_TYPE.get("-2"))
+
+    return Service(sat, None, None, name, None, None, prv, st, None, picon_id, ssid, freq, rate, pol,
+                   fec, SYSTEM.get(sys), sat_pos, data_id, fav_id, tr)
 
 
 if __name__ == "__main__":
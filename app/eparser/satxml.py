@@ -2,10 +2,11 @@
 
     For more info see __COMMENT
 """
-from xml.dom.minidom import parse, Document
+from xml.etree.ElementTree import iterparse
 
 from app.commons import log
-from .ecommons import POLARIZATION, FEC, SYSTEM, MODULATION, Transponder, Satellite, get_key_by_value
+from .ecommons import (POLARIZATION, FEC, SYSTEM, MODULATION, Transponder, Satellite, get_key_by_value,
+                       escape_xml_attr, write_atomically)
 
 __COMMENT = ("   File was created in DemonEditor\n\n"
              "usable flags are\n"
@@ -30,91 +31,95 @@ __COMMENT = ("   File was created in DemonEditor\n\n"
 
 
 def get_satellites(path):
+    """ Returns a generator of satellites. """
     return parse_satellites(path)
 
 
 def write_satellites(satellites, data_path):
-    """ Creation satellites.xml file """
-    doc = Document()
-    comment = doc.createComment(__COMMENT)
-    doc.appendChild(comment)
-    root = doc.createElement("satellites")
-    doc.appendChild(root)
-
-    for sat in satellites:
-        #    Create Element
-        sat_child = doc.createElement("sat")
-        sat_child.setAttribute("name", sat.name)
-        sat_child.setAttribute("flags", sat.flags)
-        sat_child.setAttribute("position", sat.position)
-
-        for tr in sat.transponders:
-            transponder_child = doc.createElement("transponder")
-            transponder_child.setAttribute("frequency", tr.frequency)
-            transponder_child.setAttribute("symbol_rate", tr.symbol_rate)
-            transponder_child.setAttribute("polarization", get_key_by_value(POLARIZATION, tr.polarization))
-            transponder_child.setAttribute("fec_inner", get_key_by_value(FEC, tr.fec_inner) or "0")
-            transponder_child.setAttribute("system", get_key_by_value(SYSTEM, tr.system) or "0")
-            transponder_child.setAttribute("modulation", get_key_by_value(MODULATION, tr.modulation) or "0")
-            if tr.pls_mode:
-                transponder_child.setAttribute("pls_mode", tr.pls_mode)
-            if tr.pls_code:
-                transponder_child.setAttribute("pls_code", tr.pls_code)
-            if tr.is_id:
-                transponder_child.setAttribute("is_id", tr.is_id)
-            sat_child.appendChild(transponder_child)
-        root.appendChild(sat_child)
-    doc.writexml(open(data_path, "w"),
-                 # indent="",
-                 addindent="    ",
-                 newl='\n',
-                 encoding="iso-8859-1")
-    doc.unlink()
-
-
-def parse_transponders(elem, sat_name):
-    """ Parsing satellite transponders """
-    transponders = []
-    for el in elem.getElementsByTagName("transponder"):
-        if el.hasAttributes():
-            atr = el.attributes
-            try:
-                tr = Transponder(atr["frequency"].value,
-                                 atr["symbol_rate"].value,
-                                 POLARIZATION[atr["polarization"].value],
-                                 FEC[atr["fec_inner"].value],
-                                 SYSTEM[atr["system"].value],
-                                 MODULATION[atr["modulation"].value],
-                                 atr["pls_mode"].value if "pls_mode" in atr else None,
-                                 atr["pls_code"].value if "pls_code" in atr else None,
-                                 atr["is_id"].value if "is_id" in atr else None)
-            except Exception as e:
-                message = "Error: can't parse transponder for '{}' satellite! {}".format(sat_name, repr(e))
-                log(message)
-            else:
-                transponders.append(tr)
-    return transponders
-
-
-def parse_sat(elem):
-    """ Parsing satellite """
-    sat_name = elem.attributes["name"].value
-    return Satellite(sat_name,
-                     elem.attributes["flags"].value,
-                     elem.attributes["position"].value,
-                     parse_transponders(elem, sat_name))
+    """ Creation satellites.xml file
+
+        Elements are written one by one. The output is the same as minidom's writexml gives.
+    """
+    with write_atomically(data_path) as file:
+        file.write('<?xml version="1.0" encoding="iso-8859-1"?>\n')
+        file.write("<!--{}-->\n".format(__COMMENT))
+        root_tag = "<satellites>\n"
+
+        for sat in satellites:
+            file.write(root_tag)
+            root_tag = ""
+            file.write("    <sat{}{}{}".format(get_attr("name", sat.name),
+                                               get_attr("flags", sat.flags),
+                                               get_attr("position", sat.position)))
+            if not sat.transponders:
+                file.write("/>\n")
+                continue
+
+            file.write(">\n")
+            for tr in sat.transponders:
+                file.write("        <transponder")
+                file.write(get_attr("frequency", tr.frequency))
+                file.write(get_attr("symbol_rate", tr.symbol_rate))
+                file.write(get_attr("polarization", get_key_by_value(POLARIZATION, tr.polarization)))
+                file.write(get_attr("fec_inner", get_key_by_value(FEC, tr.fec_inner) or "0"))
+                file.write(get_attr("system", get_key_by_value(SYSTEM, tr.system) or "0"))
+                file.write(get_attr("modulation", get_key_by_value(MODULATION, tr.modulation) or "0"))
+                if tr.pls_mode:
+                    file.write(get_attr("pls_mode", tr.pls_mode))
+                if tr.pls_code:
+                    file.write(get_attr("pls_code", tr.pls_code))
+                if tr.is_id:
+                    file.write(get_attr("is_id", tr.is_id))
+                file.write("/>\n")
+            file.write("    </sat>\n")
+
+        file.write("</satellites>\n" if not root_tag else "<satellites/>\n")
+
+
+def get_attr(name, value):
+    """ Returns a string of the xml attribute. """
+    return ' {}="{}"'.format(name, escape_xml_attr(value) if value else "")
+
+
+def parse_transponder(attrs, sat_name):
+    """ Parsing satellite transponder """
+    try:
+        return Transponder(attrs["frequency"],
+                           attrs["symbol_rate"],
+                           POLARIZATION[attrs["polarization"]],
+                           FEC[attrs["fec_inner"]],
+                           SYSTEM[attrs["system"]],
+                           MODULATION[attrs["modulation"]],
+                           attrs.get("pls_mode", None),
+                           attrs.get("pls_code", None),
+                           attrs.get("is_id", None))
+    except Exception as e:
+        message = "Error: can't parse transponder for '{}' satellite! {}".format(sat_name, repr(e))
+        log(message)
 
 
 def parse_satellites(path):
-    """ Parsing satellites from xml"""
-    dom = parse(path)
-    satellites = []
-
-    for elem in dom.getElementsByTagName("sat"):
-        if elem.hasAttributes():
-            satellites.append(parse_sat(elem))
-
-    return satellites
+    """ Parsing satellites from xml.
+
+        Satellites are generated while reading the file.
+    """
+    sat_name, transponders = None, []
+
+    for event, elem in iterparse(path, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "sat" and elem.attrib:
+                sat_name, transponders = elem.attrib["name"], []
+        elif tag == "transponder":
+            if sat_name is not None and elem.attrib:
+                tr = parse_transponder(elem.attrib, sat_name)
+                if tr:
+                    transponders.append(tr)
+        elif tag == "sat":
+            if sat_name is not None:
+                yield Satellite(sat_name, elem.attrib["flags"], elem.attrib["position"], transponders)
+            sat_name = None
+            elem.clear()
 
 
 if __name__ == "__main__":
@@ -696,6 +696,24 @@ class Settings:
     def remove_unused_bouquets(self, value):
         self._settings["remove_unused_bouquets"] = value
 
+    @property
+    def sync_transfer(self):
+        """ Only added or changed files are transferred via FTP. """
+        return self._settings.get("sync_transfer", False)
+
+    @sync_transfer.setter
+    def sync_transfer(self, value):
+        self._settings["sync_transfer"] = value
+
+    @property
+    def upload_archive(self):
+        """ All files are uploaded as a single archive and unpacked in the receiver via telnet. """
+        return self._settings.get("upload_archive", False)
+
+    @upload_archive.setter
+    def upload_archive(self, value):
+        self._settings["upload_archive"] = value
+
     # **************** Debug **************** #
 
     @property
@@ -1,109 +1,641 @@
 """  Module for working with epg.dat file """
+import mmap
+import os
+import pickle
+import re
 import struct
+import time
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, Counter
 from datetime import datetime
-from xml.dom.minidom import parse, Node, Document
+from xml.parsers.expat import ParserCreate
 
-from app.eparser.ecommons import BqServiceType, BouquetService
+from app.commons import log
+from app.eparser.ecommons import BqServiceType, BouquetService, escape_xml_attr, write_atomically
+
+# Event data. Start time is a UTC timestamp, duration in seconds.
+EpgEvent = namedtuple("EpgEvent", ["event_id", "start", "duration", "title", "description", "ext_description"])
 
 
 class EPG:
 
     @staticmethod
     def get_epg_refs(path):
-        """ The read algorithm was taken from the eEPGCache::load() function from this source:
-            https://github.com/OpenPLi/enigma2/blob/44d9b92f5260c7de1b3b3a1b9a9cbe0f70ca4bf0/lib/dvb/epgcache.cpp#L1300
+        """ Returns a set of the services references [sid:tsid:nid] from the epg.dat file. """
+        with EpgReader(path) as reader:
+            return set(reader.get_refs())
+
+
+class EpgReader:
+    """ Reader of the epg.dat [ENIGMA_EPG_V7] file.
+
+        The file is memory-mapped and decoded with struct.unpack_from.
+        On opening, only the channels headers are read to build an index of events offsets per service,
+        so the events of a single service can be loaded without decoding the whole file.
+
+        The read algorithm was taken from the eEPGCache::load() function from this source:
+        https://github.com/OpenPLi/enigma2/blob/44d9b92f5260c7de1b3b3a1b9a9cbe0f70ca4bf0/lib/dvb/epgcache.cpp#L1300
+    """
+    _MAGIC = 0x98765432
+    _HEADER = b"ENIGMA_EPG_V7"
+    _SHORT_EVENT = 0x4D
+    _EXTENDED_EVENT = 0x4E
+    _MJD_UNIX_EPOCH = 40587  # Modified Julian Date of 01.01.1970
+
+    def __init__(self, path, descriptors_offset=None):
+        """ @param descriptors_offset: known offset of the descriptors section [from the previous reading].
+                                       If set, the channels index is not built and events are read by offsets.
         """
-        refs = set()
+        self._index = {}  # ref -> (offset, events count)
+        self._descriptors = None  # hash -> offset
+        self._descriptors_offset = 0
 
         with open(path, mode="rb") as f:
-            crc = struct.unpack("<I", f.read(4))[0]
-            if crc != int(0x98765432):
-                raise ValueError("Epg file has incorrect byte order!")
+            try:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("Epg file is empty!")
+
+        try:
+            if descriptors_offset is None:
+                self.init_index()
+            else:
+                self.check_header()
+                if descriptors_offset > len(self._buf):
+                    raise ValueError("Epg file is truncated!")
+                self._descriptors_offset = descriptors_offset
+        except (struct.error, IndexError):
+            self.close()
+            raise ValueError("Epg file is truncated!")
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._buf.close()
+
+    @property
+    def descriptors_offset(self):
+        return self._descriptors_offset
+
+    def check_header(self):
+        buf = self._buf
+        if struct.unpack_from("<I", buf, 0)[0] != self._MAGIC:
+            raise ValueError("Epg file has incorrect byte order!")
+
+        if buf[4:17] != self._HEADER:
+            raise ValueError("Unsupported format of epd.dat file!")
+
+    def init_index(self):
+        self.check_header()
+        buf = self._buf
+        channels_count = struct.unpack_from("<I", buf, 17)[0]
+        offset, size = 21, len(buf)
+
+        for i in range(channels_count):
+            sid, nid, tsid, events_size = struct.unpack_from("<IIII", buf, offset)
+            offset += 16
+            self._index["{:X}:{:X}:{:X}".format(sid, tsid, nid)] = (offset, events_size)
+            # Skipping events: [type, len] + 10 bytes of the event header + crc list.
+            for j in range(events_size):
+                if offset + 2 > size:
+                    raise ValueError("Epg file is truncated!")
+                offset += 12 + max(buf[offset + 1] - 10, 0) // 4 * 4
+
+        if offset > len(buf):
+            raise ValueError("Epg file is truncated!")
+
+        self._descriptors_offset = offset
+
+    def get_refs(self):
+        """ Returns services references [sid:tsid:nid] of all channels. """
+        return self._index.keys()
+
+    def get_events(self, ref):
+        """ Returns a list of events for the given service reference [sid:tsid:nid].
+
+            Raises ValueError if the events data is corrupted.
+        """
+        try:
+            return self.read_events(ref)
+        except (struct.error, IndexError):
+            raise ValueError("Epg file is corrupted!")
+
+    def get_event(self, offset):
+        """ Returns the event at the given offset [from the get_times].
+
+            Raises ValueError if the events data is corrupted.
+        """
+        try:
+            return self.read_event(offset, self.get_descriptors())
+        except (struct.error, IndexError):
+            raise ValueError("Epg file is corrupted!")
+
+    def get_times(self, ref):
+        """ Returns a list of [start, duration, offset] of the events for the given service reference.
+
+            Descriptors are not decoded, so it is much faster than get_events.
+        """
+        data = self._index.get(ref, None)
+        if not data:
+            return []
+
+        buf = self._buf
+        offset, count = data
+        times = []
+        try:
+            for i in range(count):
+                start, duration = self.read_time(offset + 2)
+                times.append((start, duration, offset))
+                offset += 12 + max(buf[offset + 1] - 10, 0) // 4 * 4
+        except (struct.error, IndexError):
+            raise ValueError("Epg file is corrupted!")
 
-            header = f.read(13).decode()
-            if header != "ENIGMA_EPG_V7":
-                raise ValueError("Unsupported format of epd.dat file!")
+        return times
 
-            channels_count = struct.unpack("<I", f.read(4))[0]
+    def read_events(self, ref):
+        data = self._index.get(ref, None)
+        if not data:
+            return []
 
-            for i in range(channels_count):
-                sid, nid, tsid, events_size = struct.unpack("<IIII", f.read(16))
-                service_id = "{:X}:{:X}:{:X}".format(sid, tsid, nid)
+        descriptors = self.get_descriptors()
+        offset, count = data
+        events = []
 
-                for j in range(events_size):
-                    _type, _len = struct.unpack("<BB", f.read(2))
-                    f.read(10)
-                    n_crc = (_len - 10) // 4
-                    if n_crc > 0:
-                        [f.read(4) for n in range(n_crc)]
+        for i in range(count):
+            events.append(self.read_event(offset, descriptors))
+            offset += 12 + max(self._buf[offset + 1] - 10, 0) // 4 * 4
 
-                refs.add(service_id)
+        return events
 
-        return refs
+    def read_time(self, offset):
+        """ Returns the start time and duration from the event header at the given offset. """
+        buf = self._buf
+        mjd = struct.unpack_from(">H", buf, offset + 2)[0]
+        h, m, s, dh, dm, ds = buf[offset + 4: offset + 10]
+        start = (mjd - self._MJD_UNIX_EPOCH) * 86400 + self.bcd(h) * 3600 + self.bcd(m) * 60 + self.bcd(s)
+        return start, self.bcd(dh) * 3600 + self.bcd(dm) * 60 + self.bcd(ds)
+
+    def read_event(self, offset, descriptors):
+        buf = self._buf
+        length = buf[offset + 1]
+        offset += 2
+        event_id = struct.unpack_from(">H", buf, offset)[0]
+        start, duration = self.read_time(offset)
+        n_crc = (length - 10) // 4
+        crc_list = struct.unpack_from("<{}I".format(n_crc), buf, offset + 10) if n_crc > 0 else ()
+
+        title, desc, ext_desc = "", "", []
+        for crc in crc_list:
+            d_offset = descriptors.get(crc, None)
+            if d_offset is None:
+                continue
+
+            tag, d_len = buf[d_offset], buf[d_offset + 1]
+            d_data = buf[d_offset + 2: d_offset + 2 + d_len]
+            if tag == self._SHORT_EVENT and not title:
+                title, desc = self.parse_short_event(d_data)
+            elif tag == self._EXTENDED_EVENT:
+                ext_desc.append(self.parse_extended_event(d_data))
+
+        return EpgEvent(event_id, start, duration, title, desc, "".join(ext_desc))
+
+    def get_descriptors(self):
+        """ Returns the descriptors index [hash -> offset]. Built on first call. """
+        if self._descriptors is None:
+            descriptors = {}
+            buf, offset = self._buf, self._descriptors_offset
+            if offset + 4 <= len(buf):
+                count = struct.unpack_from("<I", buf, offset)[0]
+                offset += 4
+                for i in range(count):
+                    # hash, ref count, [tag, len] + len bytes.
+                    d_hash = struct.unpack_from("<I", buf, offset)[0]
+                    descriptors[d_hash] = offset + 8
+                    offset += 10 + buf[offset + 9]
+            self._descriptors = descriptors
+
+        return self._descriptors
+
+    @staticmethod
+    def bcd(value):
+        return (value >> 4) * 10 + (value & 0x0F)
+
+    @staticmethod
+    def parse_short_event(data):
+        """ Returns the event name and text from the short event descriptor [0x4D]. """
+        name_len = data[3]
+        name = decode_text(data[4: 4 + name_len])
+        text_len = data[4 + name_len]
+        return name, decode_text(data[5 + name_len: 5 + name_len + text_len])
+
+    @staticmethod
+    def parse_extended_event(data):
+        """ Returns the text from the extended event descriptor [0x4E]. """
+        items_len = data[4]
+        offset = 5 + items_len
+        return decode_text(data[offset + 1: offset + 1 + data[offset]])
+
+
+def decode_text(data):
+    """ Decodes DVB text [EN 300 468, Annex A]. """
+    if not data:
+        return ""
+
+    first = data[0]
+    encoding = "iso-8859-1"  # Instead of the default ISO/IEC 6937.
+    if first < 0x20:
+        if 0x01 <= first <= 0x0B:
+            encoding = "iso-8859-{}".format(first + 4)
+            data = data[1:]
+        elif first == 0x10 and len(data) > 2:
+            encoding = "iso-8859-{}".format(data[2])
+            data = data[3:]
+        elif first == 0x11:
+            encoding = "utf-16-be"
+            data = data[1:]
+        elif first == 0x15:
+            encoding = "utf-8"
+            data = data[1:]
+        else:
+            data = data[1:]
+
+    try:
+        text = data.decode(encoding, errors="replace")
+    except LookupError:
+        text = data.decode("iso-8859-1")
+    # Removing control codes [0x80 - 0x9F] and emphasis marks.
+    return "".join(c for c in text if not "\x80" <= c <= "\x9f")
+
+
+class EpgIndex:
+    """ Local store of the events from the epg.dat file for the fast "now/next" and time range lookup.
+
+        Only the times of the events are stored for each service, sorted by start time:
+        start times, durations, the running maximum of end times [interval index] and the events offsets in epg.dat.
+        Titles and descriptions are decoded from the epg.dat file on lookup.
+        The index is saved next to the epg.dat file and rebuilt when the file is changed.
+    """
+    _VERSION = 2
+    _SUFFIX = ".index"
+
+    __slots__ = ["_path", "_key", "_services", "_descriptors_offset", "_reader"]
+
+    def __init__(self, path, key, services, descriptors_offset):
+        self._path = path
+        self._key = key
+        self._services = services  # ref -> (starts, durations, max ends, offsets)
+        self._descriptors_offset = descriptors_offset
+        self._reader = None
+
+    @staticmethod
+    def get_key(path):
+        st = os.stat(path)
+        return EpgIndex._VERSION, st.st_mtime_ns, st.st_size
+
+    @classmethod
+    def from_file(cls, path):
+        """ Builds the index from the epg.dat file. """
+        key = cls.get_key(path)
+        services = {}
+        with EpgReader(path) as reader:
+            for ref in reader.get_refs():
+                times = sorted(reader.get_times(ref))
+                if not times:
+                    continue
+
+                max_ends, max_end = array("q"), 0
+                for start, duration, offset in times:
+                    max_end = max(max_end, start + duration)
+                    max_ends.append(max_end)
+                services[ref] = (array("q", (t[0] for t in times)), array("l", (t[1] for t in times)),
+                                 max_ends, array("q", (t[2] for t in times)))
+
+            return cls(path, key, services, reader.descriptors_offset)
+
+    @classmethod
+    def load(cls, path):
+        """ Returns the index for the epg.dat file.
+
+            The saved index is used if it is up to date, otherwise the index is rebuilt and saved.
+        """
+        key = cls.get_key(path)
+        index_path = path + cls._SUFFIX
+        try:
+            with open(index_path, "rb") as file:
+                if pickle.load(file) == key:
+                    descriptors_offset, services = pickle.load(file)
+                    return cls(path, key, services, descriptors_offset)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log("EPG index loading error: {}".format(e))
+
+        index = cls.from_file(path)
+        try:
+            with write_atomically(index_path, "wb") as file:
+                pickle.dump(key, file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((index._descriptors_offset, index._services), file, pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            log("EPG index writing error: {}".format(e))
+
+        return index
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def get_reader(self):
+        """ Returns the reader of the epg.dat file or None if the file has been changed since indexing. """
+        try:
+            if self.get_key(self._path) != self._key:
+                self.close()
+                return
+        except OSError:
+            self.close()
+            return
+
+        if self._reader is None:
+            self._reader = EpgReader(self._path, self._descriptors_offset)
+        return self._reader
+
+    def get_event(self, reader, offset):
+        try:
+            return reader.get_event(offset)
+        except ValueError as e:
+            log("EPG event reading error: {}".format(e))
+
+    @staticmethod
+    def get_ref(fav_id):
+        """ Returns the epg reference [sid:tsid:nid] for the Enigma2 service fav id. """
+        return ":".join("{:X}".format(int(v or "0", 16)) for v in fav_id.split(":")[:3])
+
+    def __len__(self):
+        return len(self._services)
+
+    def __contains__(self, ref):
+        return ref in self._services
+
+    def get_events(self, ref, start=None, end=None):
+        """ Returns events of the service which overlap the [start, end) time range. """
+        data = self._services.get(ref, None)
+        reader = self.get_reader() if data else None
+        if not reader:
+            return []
+
+        starts, durations, max_ends, offsets = data
+        # The first event that may end after the start of the range.
+        index = 0 if start is None else bisect_right(max_ends, start)
+        last = len(starts) if end is None else bisect_right(starts, end - 1)
+        indexes = (i for i in range(index, last) if start is None or starts[i] + durations[i] > start)
+
+        return list(filter(None, (self.get_event(reader, offsets[i]) for i in indexes)))
+
+    def get_now_next(self, ref, t=None, reader=None):
+        """ Returns a tuple of the current and next events of the service. Missing events are None. """
+        data = self._services.get(ref, None)
+        reader = reader or (self.get_reader() if data else None)
+        if not reader:
+            return None, None
+
+        t = time.time() if t is None else t
+        starts, durations, max_ends, offsets = data
+        index = bisect_right(starts, t)
+        now, nxt = None, self.get_event(reader, offsets[index]) if index < len(starts) else None
+        # Going back while the events can cover the time.
+        i = index - 1
+        while i >= 0 and max_ends[i] > t:
+            if starts[i] + durations[i] > t:
+                now = self.get_event(reader, offsets[i])
+                break
+            i -= 1
+
+        return now, nxt
+
+    def get_now_next_all(self, refs, t=None):
+        """ Returns a dict of the [now, next] events for the given services references. """
+        reader = self.get_reader()
+        if not reader:
+            return {}
+
+        t = time.time() if t is None else t
+        return {ref: self.get_now_next(ref, t, reader) for ref in refs if ref in self._services}
+
+
+class ChannelsMatcher:
+    """ Matcher of the services names with the names of the EPG source.
+
+        Names are normalized [transliterated, upper case, without non-word chars] once while building the index.
+        A name is looked up by the exact normalized name, then by the name without quality suffixes [HD, SD ...],
+        then among the candidates sharing the trigrams of the name, ranked by the similarity score.
+        Similar candidates are accepted only with the same numbers [e.g. "Sport 1" and "Sport 3" are different].
+    """
+    _WORD_PATTERN = re.compile(r"[^\W_]+")
+    _NUMBER_PATTERN = re.compile(r"\d+")
+    _QUALITY = {"HD", "FHD", "UHD", "SD", "4K", "HEVC"}
+    # Trigrams present in more than this share of names are not used for the candidates retrieval.
+    _MAX_FREQUENCY = 0.05
+    _MIN_SCORE = 0.75
+
+    __slots__ = ["_tr", "_refs", "_keys", "_numbers", "_index", "_short_index", "_trigrams", "_max_postings"]
+
+    def __init__(self, source, use_cyrillic=False):
+        """ @param source: iterable of the [name, reference] pairs. """
+        self._tr = None
+        if use_cyrillic:
+            # may be not entirely correct
+            symbols = (u"АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯІÏҐЎЈЂЉЊЋЏTB",
+                       u"ABVGDEEJZIJKLMNOPRSTUFHZCSS_Y_EUAIEGUEDLNCJTV")
+            self._tr = {ord(k): ord(v) for k, v in zip(*symbols)}
+
+        self._refs = []
+        self._keys = []
+        self._numbers = []
+        self._index = {}
+        self._short_index = {}
+        self._trigrams = {}
+
+        for name, ref in source:
+            key, short_key = self.normalize(name)
+            if not key:
+                continue
+            # The last of the duplicates is used.
+            pos = self._index.get(key, None)
+            if pos is not None:
+                self._refs[pos] = ref
+                continue
+
+            pos = len(self._refs)
+            self._index[key] = pos
+            self._short_index.setdefault(short_key, pos)
+            self._refs.append(ref)
+            self._keys.append(key)
+            self._numbers.append(self.get_numbers(short_key))
+            for t in self.get_trigrams(key):
+                self._trigrams.setdefault(t, []).append(pos)
+
+        self._max_postings = max(10, int(len(self._refs) * self._MAX_FREQUENCY))
+
+    def normalize(self, name):
+        """ Returns the normalized name and the name without quality suffixes. """
+        name = str(name).upper()
+        if self._tr:
+            name = name.translate(self._tr)
+        words = self._WORD_PATTERN.findall(name)
+        short_words = words
+        while len(short_words) > 1 and short_words[-1] in self._QUALITY:
+            short_words = short_words[:-1]
+
+        return "".join(words), "".join(short_words)
+
+    def get_numbers(self, key):
+        return tuple(int(n) for n in self._NUMBER_PATTERN.findall(key))
+
+    @staticmethod
+    def get_trigrams(key):
+        key = " {} ".format(key)
+        return {key[i: i + 3] for i in range(len(key) - 2)}
+
+    def match(self, name):
+        """ Returns the reference for the given name or None if not found. """
+        key, short_key = self.normalize(name)
+        if not key:
+            return
+
+        pos = self._index.get(key, None)
+        if pos is None:
+            pos = self._short_index.get(short_key, None)
+        if pos is None:
+            pos = self.get_best_candidate(key, self.get_numbers(short_key))
+
+        return None if pos is None else self._refs[pos]
+
+    def get_best_candidate(self, key, numbers):
+        trigrams = self.get_trigrams(key)
+        counter = Counter()
+        for t in trigrams:
+            postings = self._trigrams.get(t, None)
+            if postings and len(postings) <= self._max_postings:
+                counter.update(postings)
+
+        best_pos, best_score = None, self._MIN_SCORE
+        for pos, count in counter.most_common(20):
+            if self._numbers[pos] != numbers:
+                continue
+            c_trigrams = self.get_trigrams(self._keys[pos])
+            # Dice coefficient of the trigrams sets.
+            score = 2 * len(trigrams & c_trigrams) / (len(trigrams) + len(c_trigrams))
+            if score > best_score:
+                best_pos, best_score = pos, score
+
+        return best_pos
 
 
 class ChannelsParser:
     _COMMENT = "File was created in DemonEditor"
 
+    _CHUNK_SIZE = 64 * 1024
+
     @staticmethod
-    def get_refs_from_xml(path):
+    def get_refs_from_xml(path, refs=None):
         """ Returns tuple from references and description. """
-        refs = []
-        dom = parse(path)
-        description = "".join(n.data + "\n" for n in dom.childNodes if n.nodeType == Node.COMMENT_NODE)
-
-        for elem in dom.getElementsByTagName("channels"):
-            c_count = 0
-            comment_count = 0
-            current_data = ""
-
-            if elem.hasChildNodes():
-                for n in elem.childNodes:
-                    if n.nodeType == Node.COMMENT_NODE:
-                        c_count += 1
-                        comment_count += 1
-                        txt = n.data.strip()
-                        if comment_count:
-                            comment_count -= 1
-                        else:
-                            ref_data = current_data.split(":")
-                            refs.append(BouquetService(name=txt,
-                                                       type=BqServiceType.DEFAULT,
-                                                       data="{}:{}:{}:{}".format(*ref_data[3:7]).upper(),
-                                                       num="{}:{}:{}".format(*ref_data[3:6]).upper()))
-
-                    if n.hasChildNodes():
-                        for s_node in n.childNodes:
-                            if s_node.nodeType == Node.TEXT_NODE:
-                                comment_count -= 1
-                                current_data = s_node.data
-        return refs, description
+        comments = []
+        if isinstance(path, str):
+            with open(path, "rb") as f:
+                services = list(ChannelsParser.parse_refs(f, refs, comments))
+        else:
+            services = list(ChannelsParser.parse_refs(path, refs, comments))
+
+        return services, "".join(c + "\n" for c in comments)
+
+    @staticmethod
+    def parse_refs(file, refs=None, comments=None):
+        """ Returns a generator of the references from the channels xml [binary file object].
+
+            The file is read by chunks. The name of the channel is taken from the comment that follows it.
+            @param refs: set of the epg references [sid:tsid:nid] for filtering on the fly.
+            @param comments: list for the document level comments [description].
+        """
+        services = []
+        depth, text, data = 0, None, None
+
+        def start_element(name, attrs):
+            nonlocal depth, text, data
+            depth += 1
+            if name == "channel":
+                text, data = [], None
+
+        def end_element(name):
+            nonlocal depth, text, data
+            depth -= 1
+            if name == "channel" and text is not None:
+                data, text = "".join(text), None
+
+        def char_data(value):
+            if text is not None:
+                text.append(value)
+
+        def comment(value):
+            nonlocal data
+            if depth == 0:
+                if comments is not None:
+                    comments.append(value)
+            elif data is not None:
+                ref_data, data = data.split(":"), None
+                if len(ref_data) < 7:
+                    return
+
+                num = "{}:{}:{}".format(*ref_data[3:6]).upper()
+                if not refs or num in refs:
+                    services.append(BouquetService(name=value.strip(),
+                                                   type=BqServiceType.DEFAULT,
+                                                   data="{}:{}:{}:{}".format(*ref_data[3:7]).upper(),
+                                                   num=num))
+
+        parser = ParserCreate()
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = char_data
+        parser.CommentHandler = comment
+
+        for chunk in iter(lambda: file.read(ChannelsParser._CHUNK_SIZE), b""):
+            parser.Parse(chunk, False)
+            yield from services
+            services.clear()
+
+        parser.Parse(b"", True)
+        yield from services
 
     @staticmethod
     def write_refs_to_xml(path, services):
         header = '<?xml version="1.0" encoding="utf-8"?>\n<!--  {} -->\n<!-- {} -->\n<channels>\n'.format(
             "Created in DemonEditor.", datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        doc = Document()
-        lines = [header]
-
-        for srv in services:
-            srv_type = srv.type
-            if srv_type is BqServiceType.IPTV:
-                channel_child = doc.createElement("channel")
-                channel_child.setAttribute("id", str(srv.num))
-                data = srv.data.strip().split(":")
-                channel_child.appendChild(doc.createTextNode(":".join(data[:10])))
-                comment = doc.createComment(srv.name)
-                lines.append("{} {}\n".format(str(channel_child.toxml()), str(comment.toxml())))
-            elif srv_type is BqServiceType.MARKER:
-                comment = doc.createComment(srv.name)
-                lines.append("{}\n".format(str(comment.toxml())))
-
-        lines.append("</channels>")
-        doc.unlink()
 
         with open(path, "w", encoding="utf-8") as f:
-            f.writelines(lines)
+            f.write(header)
+            for srv in services:
+                srv_type = srv.type
+                if srv_type is BqServiceType.IPTV:
+                    data = ":".join(srv.data.strip().split(":")[:10])
+                    f.write('<channel id="{}">{}</channel> <!--{}-->\n'.format(escape_xml_attr(str(srv.num)),
+                                                                               escape_xml_attr(data),
+                                                                               get_comment(srv.name)))
+                elif srv_type is BqServiceType.MARKER:
+                    f.write("<!--{}-->\n".format(get_comment(srv.name)))
+            f.write("</channels>")
+
+
+def get_comment(text):
+    """ Returns the text suitable for the xml comment. """
+    return re.sub("-(?=-)", "- ", text)
 
 
 if __name__ == "__main__":
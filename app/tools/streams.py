@@ -0,0 +1,578 @@
+""" Module for checking the availability and probing of the IPTV streams. """
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import ssl
+import time
+from collections import namedtuple
+from threading import Lock
+from urllib.parse import urlparse, urljoin
+from urllib.request import Request, urlopen
+
+from app.commons import log
+from app.eparser.ecommons import write_atomically
+from app.settings import CONFIG_PATH
+
+_USER_AGENT = "Mozilla/5.0 (X11; Linux i586; rv:31.0) Gecko/20100101 Firefox/69.0"
+_HEADERS = "User-Agent: {}\r\nAccept: */*\r\n".format(_USER_AGENT)
+_MAX_HEADERS = 100
+
+# Stream parameters. Bitrate in bits per second. Variants [HLS] -> tuple of (bandwidth, resolution, codecs).
+StreamInfo = namedtuple("StreamInfo", ["video", "audio", "width", "height", "bitrate", "variants"])
+
+
+class StreamsChecker:
+    """ Asynchronous checker of the streams availability.
+
+        Streams are probed with HEAD requests. If HEAD is not supported, a ranged GET request is used.
+        The number of simultaneous probes is limited in total and per host.
+        Results are cached for the [ttl] seconds, so repeated checks skip recently verified streams.
+    """
+    _CACHE = {}  # url -> (time, available)
+    _CACHE_LOCK = Lock()
+
+    def __init__(self, concurrency=200, per_host=32, timeout=5, ttl=3600, max_redirects=3):
+        self._concurrency = concurrency
+        self._per_host = per_host
+        self._timeout = timeout
+        self._ttl = ttl
+        self._max_redirects = max_redirects
+        self._ssl_context = ssl.create_default_context()
+        self._loop = None
+        self._task = None
+        self._semaphore = None
+        self._hosts = {}
+
+    def check(self, urls, callback=None):
+        """ Checks the given urls and returns a dict [url -> availability].
+
+            Blocks the calling thread until all urls are checked or the check is cancelled.
+            @param callback: function [url, available] called for each checked url.
+        """
+        results = {}
+        to_check = []
+        now = time.time()
+
+        with self._CACHE_LOCK:
+            for url in urls:
+                cached = self._CACHE.get(url, None)
+                if cached and now - cached[0] < self._ttl:
+                    results[url] = cached[1]
+                else:
+                    to_check.append(url)
+
+        if callback:
+            for url, available in results.items():
+                callback(url, available)
+
+        if not to_check:
+            return results
+
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._hosts = {}
+        try:
+            self._task = self._loop.create_task(self.check_urls(to_check, results, callback))
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+            self._loop, self._task = None, None
+
+        return results
+
+    def cancel(self):
+        """ Cancels the current check. Can be called from any thread. """
+        loop, task = self._loop, self._task
+        if loop and task:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # Loop is already closed.
+
+    async def check_urls(self, urls, results, callback):
+        async def check_url(u):
+            available = await self.probe(u)
+            results[u] = available
+            with self._CACHE_LOCK:
+                self._CACHE[u] = (time.time(), available)
+            if callback:
+                callback(u, available)
+
+        await asyncio.gather(*(check_url(url) for url in urls))
+
+    async def probe(self, url):
+        """ Returns True if the stream is available. """
+        for i in range(self._max_redirects + 1):
+            try:
+                status, location = await self.request("HEAD", url)
+                if status in (405, 501):
+                    status, location = await self.request("GET", url)
+            except (OSError, asyncio.TimeoutError, ValueError, UnicodeError):
+                return False
+
+            if 300 <= status < 400 and location:
+                url = urljoin(url, location)
+                continue
+            # 403 is returned by many servers for requests without proper headers [as before].
+            return status < 400 or status == 403
+
+        return False
+
+    async def request(self, method, url):
+        """ Returns the response status and location. """
+        u = urlparse(url or "")
+        if u.scheme not in ("http", "https"):
+            raise ValueError("Unsupported scheme [{}]".format(u.scheme))
+
+        host = u.hostname
+        if not host:
+            raise ValueError("No host")
+
+        is_https = u.scheme == "https"
+        port = u.port or (443 if is_https else 80)
+        h_sem = self._hosts.get(host, None)
+        if h_sem is None:
+            h_sem = asyncio.Semaphore(self._per_host)
+            self._hosts[host] = h_sem
+
+        # The host slot is taken first, so waiting for a busy host doesn't hold the global slots.
+        async with h_sem:
+            async with self._semaphore:
+                return await asyncio.wait_for(self.send(method, u, host, port, is_https), self._timeout)
+
+    async def send(self, method, u, host, port, is_https):
+        reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl_context if is_https else None)
+        try:
+            path = u.path or "/"
+            if u.query:
+                path += "?" + u.query
+            host_header = host if u.port is None else "{}:{}".format(host, port)
+            extra = "Range: bytes=0-1023\r\n" if method == "GET" else ""
+            req = "{} {} HTTP/1.1\r\nHost: {}\r\n{}{}Connection: close\r\n\r\n".format(method, path, host_header,
+                                                                                      _HEADERS, extra)
+            writer.write(req.encode("latin-1", errors="replace"))
+            await writer.drain()
+            # "HTTP/1.1 200 OK" or "ICY 200 OK" [SHOUTcast].
+            status = int((await reader.readline()).split()[1])
+            location = None
+            for i in range(_MAX_HEADERS):
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, sep, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "location":
+                    location = value.strip()
+
+            return status, location
+        except IndexError:
+            raise ValueError("Bad response")
+        finally:
+            writer.close()
+
+
+class StreamsProber:
+    """ Reads the beginning of the streams and extracts the codecs, resolution and bitrate.
+
+        MPEG-TS streams are parsed directly. For HLS, the variants are taken from the master playlist,
+        and the first segment of the best variant is parsed.
+    """
+    _TS_PACKET_SIZE = 188
+    _ATTR_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+    _CODECS = {"avc1": "H.264", "avc3": "H.264", "hvc1": "H.265", "hev1": "H.265", "mp4a": "AAC", "ac-3": "AC3",
+               "ec-3": "E-AC3", "mp4v": "MPEG-4"}
+    # stream type -> (is video, codec)
+    _STREAM_TYPES = {0x01: (True, "MPEG-1"), 0x02: (True, "MPEG-2"), 0x10: (True, "MPEG-4"), 0x1B: (True, "H.264"),
+                     0x24: (True, "H.265"), 0x03: (False, "MP2"), 0x04: (False, "MP2"), 0x0F: (False, "AAC"),
+                     0x11: (False, "AAC"), 0x81: (False, "AC3"), 0x87: (False, "E-AC3")}
+    # descriptor tag -> codec for the private streams [0x06]
+    _DESCRIPTORS = {0x6A: "AC3", 0x7A: "E-AC3", 0x7B: "DTS"}
+
+    def __init__(self, max_size=512 * 1024, timeout=5, workers=16):
+        self._max_size = max_size
+        self._timeout = timeout
+        self._workers = workers
+        self._is_active = False
+
+    def probe_all(self, urls, callback=None):
+        """ Probes the given urls and returns a dict [url -> StreamInfo or None].
+
+            @param callback: function [url, info] called for each probed url.
+        """
+        self._is_active = True
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = {executor.submit(self.probe, url): url for url in urls}
+            for future in concurrent.futures.as_completed(futures):
+                if not self._is_active:
+                    executor.shutdown(wait=False)
+                    for f in futures:
+                        f.cancel()
+                    break
+                url = futures[future]
+                results[url] = future.result()
+                if callback:
+                    callback(url, results[url])
+
+        self._is_active = False
+        return results
+
+    def cancel(self):
+        self._is_active = False
+
+    def probe(self, url):
+        """ Returns StreamInfo for the url or None if the stream can't be read. """
+        try:
+            data, content_type = self.read(url)
+            if data.startswith(b"#EXTM3U") or "mpegurl" in content_type.lower():
+                return self.probe_hls(url, data.decode("utf-8", errors="ignore"))
+            return self.parse_ts(data)
+        except Exception as e:
+            log("Stream [{}] probing error: {}".format(url, e))
+
+    def read(self, url, size=None):
+        req = Request(url, headers={"User-Agent": _USER_AGENT})
+        with urlopen(req, timeout=self._timeout) as resp:
+            return resp.read(size or self._max_size), resp.headers.get("Content-Type", "")
+
+    def probe_hls(self, url, playlist, depth=0):
+        variants, segment = [], None
+        lines = iter(playlist.splitlines())
+
+        for line in lines:
+            line = line.strip()
+            if line.startswith("#EXT-X-STREAM-INF"):
+                attrs = {k: v.strip('"') for k, v in self._ATTR_PATTERN.findall(line.partition(":")[2])}
+                uri = next(lines, "").strip()
+                codecs = ",".join(filter(None, (self.get_codec(c) for c in attrs.get("CODECS", "").split(","))))
+                try:
+                    bandwidth = int(attrs.get("BANDWIDTH", 0))
+                except ValueError:
+                    bandwidth = 0
+                variants.append((bandwidth, attrs.get("RESOLUTION", ""), codecs, urljoin(url, uri)))
+            elif line and not line.startswith("#") and segment is None:
+                segment = urljoin(url, line)
+
+        if variants:
+            variants.sort(reverse=True)
+            bandwidth, resolution, codecs, uri = variants[0]
+            info = None
+            if depth < 2:
+                # Variant [media] playlist. If its segments can't be parsed [e.g. fMP4 or audio only],
+                # the info from the master playlist is used.
+                try:
+                    data, content_type = self.read(uri, 64 * 1024)
+                    info = self.probe_hls(uri, data.decode("utf-8", errors="ignore"), depth + 1)
+                except Exception as e:
+                    log("Stream [{}] variant probing error: {}".format(uri, e))
+
+            width, sep, height = resolution.partition("x")
+            video, audio = self.get_codecs(codecs)
+            if info:
+                video, audio = info.video or video, info.audio or audio
+                width, height = info.width or width, info.height or height
+
+            return StreamInfo(video, audio, int(width or 0), int(height or 0), bandwidth,
+                              tuple(v[:3] for v in variants))
+
+        if segment:
+            data, content_type = self.read(segment)
+            return self.parse_ts(data)
+
+    def get_codec(self, value):
+        return self._CODECS.get(value.strip().partition(".")[0], "")
+
+    def get_codecs(self, codecs):
+        video, audio = None, None
+        for c in codecs.split(","):
+            if c in ("H.264", "H.265", "MPEG-4"):
+                video = video or c
+            elif c:
+                audio = audio or c
+        return video, audio
+
+    def parse_ts(self, data):
+        """ Returns StreamInfo from the beginning of the MPEG-TS stream. """
+        size = self._TS_PACKET_SIZE
+        start = next((i for i in range(min(size, len(data) - size * 2))
+                      if data[i] == 0x47 and data[i + size] == 0x47 and data[i + size * 2] == 0x47), None)
+        if start is None:
+            raise ValueError("Unsupported stream format")
+
+        pmt_pids, streams = set(), {}
+        pcr_pid, pcr = None, []
+        video_pid, video_codec, video_data = None, None, bytearray()
+
+        for off in range(start, len(data) - size + 1, size):
+            if data[off] != 0x47:
+                continue
+
+            pid = ((data[off + 1] & 0x1F) << 8) | data[off + 2]
+            pusi = data[off + 1] & 0x40
+            afc = (data[off + 3] >> 4) & 0x3
+            p = off + 4
+            if afc & 0x2:
+                af_len = data[p]
+                if pid == pcr_pid and af_len >= 7 and data[p + 1] & 0x10:
+                    b = data[p + 2: p + 7]
+                    pcr.append(((b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) | (b[4] >> 7), off))
+                p += af_len + 1
+            if not afc & 0x1 or p >= off + size:
+                continue
+
+            payload = data[p: off + size]
+            if pid == 0 and pusi:
+                sec = payload[payload[0] + 1:]
+                end = min(len(sec), 3 + (((sec[1] & 0x0F) << 8) | sec[2]) - 4)
+                for i in range(8, end - 3, 4):
+                    if (sec[i] << 8) | sec[i + 1]:
+                        pmt_pids.add(((sec[i + 2] & 0x1F) << 8) | sec[i + 3])
+            elif pid in pmt_pids and pusi and not streams:
+                sec = payload[payload[0] + 1:]
+                end = min(len(sec), 3 + (((sec[1] & 0x0F) << 8) | sec[2]) - 4)
+                pcr_pid = ((sec[8] & 0x1F) << 8) | sec[9]
+                i = 12 + (((sec[10] & 0x0F) << 8) | sec[11])
+                while i + 5 <= end:
+                    es_len = ((sec[i + 3] & 0x0F) << 8) | sec[i + 4]
+                    streams[((sec[i + 1] & 0x1F) << 8) | sec[i + 2]] = self.get_stream_type(sec[i],
+                                                                                           sec[i + 5: i + 5 + es_len])
+                    i += 5 + es_len
+                video_pid, video_codec = next(((k, v[1]) for k, v in streams.items() if v[0]), (None, None))
+            elif pid == video_pid and len(video_data) < self._max_size // 2:
+                if pusi and payload[:3] == b"\x00\x00\x01":
+                    payload = payload[9 + payload[8]:]
+                video_data.extend(payload)
+
+        if not streams:
+            raise ValueError("No program data")
+
+        audio = next((v[1] for v in streams.values() if not v[0] and v[1]), None)
+        width, height = self.get_resolution(video_codec, bytes(video_data))
+        bitrate = 0
+        if len(pcr) > 1 and pcr[-1][0] > pcr[0][0]:
+            bitrate = int((pcr[-1][1] - pcr[0][1]) * 8 * 90000 / (pcr[-1][0] - pcr[0][0]))
+
+        return StreamInfo(video_codec, audio, width, height, bitrate, ())
+
+    def get_stream_type(self, stream_type, descriptors):
+        if stream_type == 0x06:
+            i = 0
+            while i + 1 < len(descriptors):
+                codec = self._DESCRIPTORS.get(descriptors[i], None)
+                if codec:
+                    return False, codec
+                i += 2 + descriptors[i + 1]
+            return False, None
+
+        return self._STREAM_TYPES.get(stream_type, (False, None))
+
+    @staticmethod
+    def get_resolution(codec, data):
+        """ Returns the width and height from the sequence header [MPEG-2] or SPS [H.264, H.265]. """
+        if codec in ("MPEG-1", "MPEG-2"):
+            i = data.find(b"\x00\x00\x01\xb3")
+            if i >= 0 and i + 7 <= len(data):
+                return (data[i + 4] << 4) | (data[i + 5] >> 4), ((data[i + 5] & 0x0F) << 8) | data[i + 6]
+        elif codec in ("H.264", "H.265"):
+            for nal in data.split(b"\x00\x00\x01")[1:]:
+                if not nal:
+                    continue
+                try:
+                    if codec == "H.264" and nal[0] & 0x1F == 7:
+                        return parse_h264_sps(unescape_rbsp(nal[1:]))
+                    elif codec == "H.265" and (nal[0] >> 1) & 0x3F == 33:
+                        return parse_h265_sps(unescape_rbsp(nal[2:]))
+                except (IndexError, ValueError):
+                    continue
+
+        return 0, 0
+
+
+class StreamsInfoCache:
+    """ On-disk cache of the streams info [url -> StreamInfo]. """
+
+    def __init__(self, path=CONFIG_PATH + "streams.json"):
+        self._path = path
+        self._data = {}  # url -> (time, StreamInfo)
+        self._loaded = False
+
+    def load(self):
+        if self._loaded:
+            return self
+
+        self._loaded = True
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as e:
+            log("Streams info cache loading error: {}".format(e))
+            return self
+
+        for url, (t, info) in data.items():
+            self._data[url] = (t, StreamInfo(*info[:5], tuple(tuple(v) for v in info[5])))
+        return self
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with write_atomically(self._path, encoding="utf-8") as f:
+                json.dump(self._data, f)
+        except OSError as e:
+            log("Streams info cache writing error: {}".format(e))
+
+    def get(self, url):
+        data = self._data.get(url, None)
+        return data[1] if data else None
+
+    def update(self, results):
+        """ Updates the cache with the probing results. Failed probes are skipped. """
+        t = int(time.time())
+        self._data.update((url, (t, info)) for url, info in results.items() if info)
+
+    def __contains__(self, url):
+        return url in self._data
+
+
+def get_quality(info):
+    """ Returns quality label [UHD, HD, SD] of the stream or an empty string if unknown. """
+    if not info or not info.height:
+        return ""
+    return "UHD" if info.height >= 2160 else "HD" if info.height >= 720 else "SD"
+
+
+def get_info_text(info):
+    """ Returns a short description of the stream, e.g.: "HD 1920x1080 H.264/AAC 4.5 Mbit/s". """
+    if not info:
+        return ""
+
+    text = [get_quality(info)]
+    if info.width and info.height:
+        text.append("{}x{}".format(info.width, info.height))
+    text.append("/".join(filter(None, (info.video, info.audio))))
+    if info.bitrate:
+        text.append("{:.1f} Mbit/s".format(info.bitrate / 1000000))
+    return " ".join(filter(None, text))
+
+
+class BitReader:
+    __slots__ = ["_data", "_pos"]
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, n):
+        value = 0
+        for i in range(n):
+            value = (value << 1) | ((self._data[self._pos >> 3] >> (7 - (self._pos & 7))) & 1)
+            self._pos += 1
+        return value
+
+    def skip(self, n):
+        self._pos += n
+
+    def read_ue(self):
+        """ Reads the unsigned Exp-Golomb code. """
+        zeros = 0
+        while not self.read(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("Invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.read(zeros)
+
+    def read_se(self):
+        value = self.read_ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def unescape_rbsp(data):
+    """ Removes the emulation prevention bytes. """
+    return data.replace(b"\x00\x00\x03", b"\x00\x00")
+
+
+def parse_h264_sps(data):
+    """ Returns the width and height from the H.264 sequence parameter set [ITU-T H.264, 7.3.2.1.1]. """
+    r = BitReader(data)
+    profile = r.read(8)
+    r.skip(16)
+    r.read_ue()
+    chroma_format = 1
+    if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format = r.read_ue()
+        if chroma_format == 3:
+            r.skip(1)
+        r.read_ue()
+        r.read_ue()
+        r.skip(1)
+        if r.read(1):
+            for i in range(8 if chroma_format != 3 else 12):
+                if r.read(1):
+                    last, scale = 8, 8
+                    for j in range(16 if i < 6 else 64):
+                        if scale:
+                            scale = (last + r.read_se()) % 256
+                        last = scale or last
+    r.read_ue()
+    poc_type = r.read_ue()
+    if poc_type == 0:
+        r.read_ue()
+    elif poc_type == 1:
+        r.skip(1)
+        r.read_se()
+        r.read_se()
+        for i in range(r.read_ue()):
+            r.read_se()
+    r.read_ue()
+    r.skip(1)
+    width_mbs = r.read_ue() + 1
+    height_units = r.read_ue() + 1
+    frame_mbs_only = r.read(1)
+    if not frame_mbs_only:
+        r.skip(1)
+    r.skip(1)
+    width, height = width_mbs * 16, (2 - frame_mbs_only) * height_units * 16
+    if r.read(1):
+        left, right, top, bottom = r.read_ue(), r.read_ue(), r.read_ue(), r.read_ue()
+        crop_x = 2 if chroma_format in (1, 2) else 1
+        crop_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+
+    return width, height
+
+
+def parse_h265_sps(data):
+    """ Returns the width and height from the H.265 sequence parameter set [ITU-T H.265, 7.3.2.2]. """
+    r = BitReader(data)
+    r.skip(4)
+    max_sub_layers = r.read(3)
+    r.skip(1)
+    # profile_tier_level
+    r.skip(96)
+    layers = [(r.read(1), r.read(1)) for i in range(max_sub_layers)]
+    if max_sub_layers:
+        r.skip(2 * (8 - max_sub_layers))
+    for profile_present, level_present in layers:
+        r.skip((88 if profile_present else 0) + (8 if level_present else 0))
+    r.read_ue()
+    chroma_format = r.read_ue()
+    if chroma_format == 3:
+        r.skip(1)
+    width, height = r.read_ue(), r.read_ue()
+    if r.read(1):
+        left, right, top, bottom = r.read_ue(), r.read_ue(), r.read_ue(), r.read_ue()
+        crop_x = 2 if chroma_format in (1, 2) else 1
+        crop_y = 2 if chroma_format == 1 else 1
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+
+    return width, height
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,185 @@
+""" Module for working with XMLTV files.
+
+    Files are read and written element by element, so multi-hundred-MB
+    guides [also gzipped] can be processed in bounded memory.
+"""
+import gzip
+import re
+from calendar import timegm
+from collections import namedtuple
+from datetime import datetime, timezone
+from xml.etree.ElementTree import iterparse
+
+from app.eparser.ecommons import BouquetService, BqServiceType, escape_xml_attr, write_atomically
+from app.tools.epg import EpgReader
+
+XmlTvChannel = namedtuple("XmlTvChannel", ["id", "names", "icon"])
+# Start and stop times are UTC timestamps. Stop time can be None.
+XmlTvProgramme = namedtuple("XmlTvProgramme", ["channel", "start", "stop", "title", "description"])
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_TIME_FORMAT = "%Y%m%d%H%M%S"
+_HEAD_SIZE = 4096
+_COMMENT_PATTERN = re.compile(rb"<!--.*?-->", re.DOTALL)
+_ROOT_PATTERN = re.compile(rb"<([^?!/\s>]+)")
+
+
+def open_xml(path):
+    """ Opens the xml file for reading in binary mode. Gzipped files are decompressed on the fly. """
+    f = open(path, "rb")
+    if f.peek(2)[:2] == _GZIP_MAGIC:
+        f.close()
+        return gzip.open(path, "rb")
+    return f
+
+
+def is_xmltv(file):
+    """ Checks by the root element if the binary file object [with peek support] is the XMLTV file. """
+    head = _COMMENT_PATTERN.sub(b"", file.peek(_HEAD_SIZE)[:_HEAD_SIZE])
+    match = _ROOT_PATTERN.search(head)
+    return bool(match) and match.group(1) == b"tv"
+
+
+def parse_xmltv(source):
+    """ Returns a generator of the channels and programmes from the XMLTV file path or binary file object.
+
+        Programmes without the start time are skipped.
+    """
+    if isinstance(source, str):
+        with open_xml(source) as f:
+            yield from parse_xmltv(f)
+        return
+
+    root = None
+    for event, elem in iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+
+        tag = elem.tag
+        if tag == "channel":
+            names = tuple(e.text for e in elem.iterfind("display-name") if e.text)
+            icon = elem.find("icon")
+            yield XmlTvChannel(elem.get("id"), names, icon.get("src") if icon is not None else None)
+        elif tag == "programme":
+            start, stop = elem.get("start"), elem.get("stop")
+            if start:
+                yield XmlTvProgramme(elem.get("channel"),
+                                     parse_time(start),
+                                     parse_time(stop) if stop else None,
+                                     elem.findtext("title", ""),
+                                     elem.findtext("desc", ""))
+        else:
+            continue
+        # Processed elements are cleared and removed from the tree.
+        elem.clear()
+        root.clear()
+
+
+def parse_refs(file, refs=None):
+    """ Returns a generator of the services references from the channels of the XMLTV file.
+
+        Only channels with the Enigma2 service reference or [sid:tsid:nid] as id are taken.
+        Parsing is stopped on the first programme, because channels precede programmes.
+        @param refs: set of the epg references [sid:tsid:nid] for filtering on the fly.
+    """
+    for ch in parse_xmltv(file):
+        if not isinstance(ch, XmlTvChannel):
+            break
+
+        ref_data = (ch.id or "").split(":")
+        if len(ref_data) > 6:
+            ref_data = ref_data[3:7]
+        elif len(ref_data) == 3:
+            ref_data.append("0")
+        else:
+            continue
+
+        try:
+            ref_data = ["{:X}".format(int(v, 16)) for v in ref_data]
+        except ValueError:
+            continue
+
+        num = ":".join(ref_data[:3])
+        if not refs or num in refs:
+            yield BouquetService(name=ch.names[0] if ch.names else ch.id,
+                                 type=BqServiceType.DEFAULT,
+                                 data=":".join(ref_data),
+                                 num=num)
+
+
+def parse_time(value):
+    """ Converts the XMLTV time [YYYYmmddHHMMSS +zzzz] to UTC timestamp. """
+    date, sep, offset = value.strip().partition(" ")
+    date = date[:14].ljust(14, "0")
+    ts = timegm((int(date[:4]), int(date[4:6]), int(date[6:8]), int(date[8:10]), int(date[10:12]), int(date[12:14])))
+    if offset and offset[0] in "+-":
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5] or 0)
+        ts -= minutes * 60 if offset[0] == "+" else -minutes * 60
+    return ts
+
+
+def format_time(ts):
+    return "{} +0000".format(datetime.fromtimestamp(ts, timezone.utc).strftime(_TIME_FORMAT))
+
+
+def write_xmltv(path, channels, programmes):
+    """ Writes channels and programmes to the XMLTV file. The file is gzipped if the path ends with ".gz".
+
+        @param channels: iterable of the XmlTvChannel.
+        @param programmes: iterable of the XmlTvProgramme.
+    """
+    with write_atomically(path, "wb") as raw:
+        if path.endswith(".gz"):
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                write_elements(f, channels, programmes)
+        else:
+            write_elements(raw, channels, programmes)
+
+
+def write_elements(file, channels, programmes):
+    write = file.write
+    write(b'<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n')
+    write(b'<tv generator-info-name="DemonEditor">\n')
+
+    for ch in channels:
+        lines = ['  <channel id="{}">\n'.format(escape_xml_attr(ch.id))]
+        lines.extend('    <display-name>{}</display-name>\n'.format(escape_xml_attr(n)) for n in ch.names)
+        if ch.icon:
+            lines.append('    <icon src="{}"/>\n'.format(escape_xml_attr(ch.icon)))
+        lines.append("  </channel>\n")
+        write("".join(lines).encode("utf-8"))
+
+    for p in programmes:
+        stop = ' stop="{}"'.format(format_time(p.stop)) if p.stop is not None else ""
+        lines = ['  <programme start="{}"{} channel="{}">\n'.format(format_time(p.start), stop,
+                                                                   escape_xml_attr(p.channel)),
+                 '    <title>{}</title>\n'.format(escape_xml_attr(p.title))]
+        if p.description:
+            lines.append('    <desc>{}</desc>\n'.format(escape_xml_attr(p.description)))
+        lines.append("  </programme>\n")
+        write("".join(lines).encode("utf-8"))
+
+    write(b"</tv>\n")
+
+
+def export_epg_dat(epg_path, path, names=None):
+    """ Exports events from the epg.dat file to the XMLTV file.
+
+        Events are decoded service by service.
+        @param names: dict of the services names by the epg reference [sid:tsid:nid].
+                      If set, only the given services are exported.
+    """
+    names = names or {}
+    with EpgReader(epg_path) as reader:
+        refs = [ref for ref in reader.get_refs() if not names or ref in names]
+        channels = (XmlTvChannel(ref, (names.get(ref, ref),), None) for ref in refs)
+        programmes = (XmlTvProgramme(ref, e.start, e.start + e.duration, e.title,
+                                     "\n".join(filter(None, (e.description, e.ext_description))))
+                      for ref in refs for e in sorted(reader.get_events(ref), key=lambda ev: ev.start))
+        write_xmltv(path, channels, programmes)
+
+
+if __name__ == "__main__":
+    pass
@@ -211,9 +211,10 @@ def restore_data(src, dst):
     shutil.unpack_archive(src, dst)
 
 
-def clear_data_path(path):
-    """ Clearing data at the specified path excluding satellites.xml file """
-    for file in filter(lambda f: f != "satellites.xml" and os.path.isfile(os.path.join(path, f)), os.listdir(path)):
+def clear_data_path(path, keep=()):
+    """ Clearing data at the specified path excluding satellites.xml file and files with the [keep] suffixes """
+    for file in filter(lambda f: f != "satellites.xml" and not f.endswith(keep) and os.path.isfile(
+            os.path.join(path, f)), os.listdir(path)):
         os.remove(os.path.join(path, file))
 
 
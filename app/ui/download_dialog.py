@@ -25,6 +25,8 @@ class DownloadDialog:
                     "on_profile_changed": self.on_profile_changed,
                     "on_use_http_state_set": self.on_use_http_state_set,
                     "on_remove_unused_bouquets_toggled": self.on_remove_unused_bouquets_toggled,
+                    "on_sync_toggled": self.on_sync_toggled,
+                    "on_archive_toggled": self.on_archive_toggled,
                     "on_info_bar_close": self.on_info_bar_close}
 
         builder = Gtk.Builder()
@@ -40,6 +42,8 @@ class DownloadDialog:
         self._host_entry = builder.get_object("host_entry")
         self._data_path_entry = builder.get_object("data_path_entry")
         self._remove_unused_check_button = builder.get_object("remove_unused_check_button")
+        self._sync_check_button = builder.get_object("sync_check_button")
+        self._archive_check_button = builder.get_object("archive_check_button")
         self._all_radio_button = builder.get_object("all_radio_button")
         self._bouquets_radio_button = builder.get_object("bouquets_radio_button")
         self._satellites_radio_button = builder.get_object("satellites_radio_button")
@@ -66,6 +70,8 @@ class DownloadDialog:
         self._use_http_box.set_visible(is_enigma)
         self._use_http_switch.set_active(is_enigma and self._settings.use_http)
         self._remove_unused_check_button.set_active(self._settings.remove_unused_bouquets)
+        self._sync_check_button.set_active(self._settings.sync_transfer)
+        self._archive_check_button.set_active(self._settings.upload_archive)
 
     def update_profiles(self):
         self._profile_combo_box.remove_all()
@@ -117,6 +123,12 @@ class DownloadDialog:
     def on_remove_unused_bouquets_toggled(self, button):
         self._settings.remove_unused_bouquets = button.get_active()
 
+    def on_sync_toggled(self, button):
+        self._settings.sync_transfer = button.get_active()
+
+    def on_archive_toggled(self, button):
+        self._settings.upload_archive = button.get_active()
+
     def on_info_bar_close(self, bar=None, resp=None):
         self._info_bar.set_visible(False)
 
@@ -135,7 +147,8 @@ class DownloadDialog:
                     backup_path = self._settings.backup_local_path or data_path + "backup/"
                     backup_src = backup_data(data_path, backup_path, d_type is DownloadType.ALL)
 
-                download_data(settings=self._settings, download_type=d_type, callback=self.append_output)
+                download_data(settings=self._settings, download_type=d_type, callback=self.append_output,
+                              sync=self._sync_check_button.get_active())
             else:
                 self.show_info_message(get_message("Please, wait..."), Gtk.MessageType.INFO)
                 upload_data(settings=self._settings,
@@ -143,7 +156,9 @@ class DownloadDialog:
                             remove_unused=self._remove_unused_check_button.get_active(),
                             callback=self.append_output,
                             done_callback=lambda: self.show_info_message(get_message("Done!"), Gtk.MessageType.INFO),
-                            use_http=self._use_http_switch.get_active())
+                            use_http=self._use_http_switch.get_active(),
+                            sync=self._sync_check_button.get_active(),
+                            use_archive=self._archive_check_button.get_active())
         except Exception as e:
             msg = "Downloading data error: {}"
             log(msg.format(e), debug=self._settings.debug_mode, fmt_message=msg)
@@ -1,8 +1,5 @@
-import gzip
 import locale
 import os
-import re
-import shutil
 import urllib.request
 from enum import Enum
 from urllib.error import HTTPError, URLError
@@ -11,7 +8,8 @@ from gi.repository import GLib
 from app.commons import run_idle, run_task
 from app.connections import download_data, DownloadType
 from app.eparser.ecommons import BouquetService, BqServiceType
-from app.tools.epg import EPG, ChannelsParser
+from app.tools.epg import EPG, ChannelsParser, ChannelsMatcher, EpgIndex
+from app.tools.xmltv import open_xml, export_epg_dat, is_xmltv, parse_refs
 from app.ui.dialogs import get_message, show_dialog, DialogType
 from .main_helper import on_popup_menu, update_entry_data
 from .uicommons import Gtk, Gdk, UI_RESOURCES_PATH, TEXT_DOMAIN, Column, EPG_ICON, KeyboardKey
@@ -30,6 +28,7 @@ class EpgDialog:
                     "on_apply": self.on_apply,
                     "on_update": self.on_update,
                     "on_save_to_xml": self.on_save_to_xml,
+                    "on_export_xmltv": self.on_export_xmltv,
                     "on_auto_configuration": self.on_auto_configuration,
                     "on_filter_toggled": self.on_filter_toggled,
                     "on_filter_changed": self.on_filter_changed,
@@ -166,7 +165,7 @@ class EpgDialog:
 
             try:
                 refs = EPG.get_epg_refs(self._epg_dat_path_entry.get_text() + "epg.dat")
-            except FileNotFoundError as e:
+            except (FileNotFoundError, ValueError) as e:
                 self.show_info_message("Read data error: {}".format(e), Gtk.MessageType.ERROR)
                 return
             yield True
@@ -244,31 +243,27 @@ class EpgDialog:
                             self.update_download_progress(b_num * bs / size)
                             yield True
 
-                        path = tfp.name.rstrip(".gz")
+                        path = tfp.name
             except (HTTPError, URLError) as e:
                 raise ValueError("{} {}".format(get_message("Download XML file error."), e))
-            else:
-                try:
-                    with open(path, "wb") as f_out:
-                        with gzip.open(tfp.name, "rb") as f:
-                            shutil.copyfileobj(f, f_out)
-                    os.remove(tfp.name)
-                except Exception as e:
-                    raise ValueError("{} {}".format(get_message("Unpacking data error."), e))
             finally:
                 self._download_xml_is_active = False
                 self.update_active_header_elements(True)
 
+        info = []
         try:
-            s_refs, info = ChannelsParser.get_refs_from_xml(path)
-            yield True
+            # Gzipped files are unpacked on the fly.
+            with open_xml(path) as f:
+                # XMLTV guides are also supported if the channels ids are services references.
+                services = parse_refs(f, refs) if is_xmltv(f) else ChannelsParser.parse_refs(f, refs, info)
+                for index, s in enumerate(services, start=1):
+                    self._services_model.append((s.name, s.data))
+                    if index % 1000 == 0:
+                        yield True
         except Exception as e:
             raise ValueError("{} {}".format(get_message("XML parsing error:"), e))
         else:
-            if refs:
-                s_refs = filter(lambda x: x.num in refs, s_refs)
-            list(map(lambda s: self._services_model.append((s.name, s.data)), s_refs))
-            self.update_source_info(info)
+            self.update_source_info("".join(c + "\n" for c in info))
             self.update_source_count_info()
             yield True
 
@@ -305,45 +300,48 @@ class EpgDialog:
         ChannelsParser.write_refs_to_xml("{}{}.xml".format(response, self._bouquet_name), services)
         self.show_info_message(get_message("Done!"), Gtk.MessageType.INFO)
 
+    @run_idle
+    def on_export_xmltv(self, item):
+        """ Exports events of the bouquet services from the epg.dat file to the XMLTV file. """
+        response = show_dialog(DialogType.CHOOSER, self._dialog, settings=self._settings)
+        if response in (Gtk.ResponseType.CANCEL, Gtk.ResponseType.DELETE_EVENT):
+            return
+
+        names = {}
+        for r in self._bouquet_model:
+            srv_type, fav_id = r[Column.FAV_TYPE], r[Column.FAV_ID]
+            if srv_type == BqServiceType.MARKER.value:
+                continue
+            if srv_type == BqServiceType.IPTV.value:
+                fav_id = ":".join(fav_id.split(":")[3:6])
+            names[EpgIndex.get_ref(fav_id)] = r[Column.FAV_SERVICE]
+
+        epg_path = self._epg_dat_path_entry.get_text() + "epg.dat"
+        self.export_xmltv(epg_path, "{}{}.xml".format(response, self._bouquet_name), names)
+
+    @run_task
+    def export_xmltv(self, epg_path, path, names):
+        try:
+            export_epg_dat(epg_path, path, names)
+        except (OSError, ValueError) as e:
+            GLib.idle_add(self.show_info_message, "Export to XMLTV error: {}".format(e), Gtk.MessageType.ERROR)
+        else:
+            GLib.idle_add(self.show_info_message, get_message("Done!"), Gtk.MessageType.INFO)
+
     @run_idle
     def on_auto_configuration(self, item):
-        """ Simple mapping of services by name. """
+        """ Mapping of services by name. """
         use_cyrillic = locale.getdefaultlocale()[0] in ("ru_RU", "be_BY", "uk_UA", "sr_RS")
-        tr = None
-        if use_cyrillic:
-            # may be not entirely correct
-            symbols = (u"АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯІÏҐЎЈЂЉЊЋЏTB",
-                       u"ABVGDEEJZIJKLMNOPRSTUFHZCSS_Y_EUAIEGUEDLNCJTV")
-            tr = {ord(k): ord(v) for k, v in zip(*symbols)}
-
-        source = {}
-        for row in self._services_model:
-            name = re.sub("\\W+", "", str(row[0])).upper()
-            name = name.translate(tr) if use_cyrillic else name
-            source[name] = row[1]
-
+        matcher = ChannelsMatcher(((r[0], r[1]) for r in self._services_model), use_cyrillic)
         success_count = 0
-        not_founded = {}
 
         for r in self._bouquet_model:
             if r[Column.FAV_TYPE] != BqServiceType.IPTV.value:
                 continue
-            name = re.sub("\\W+", "", str(r[Column.FAV_SERVICE])).upper()
-            if use_cyrillic:
-                name = name.translate(tr)
-            ref = source.get(name, None)  # Not [pop], because the list may contain duplicates or similar names!
+            ref = matcher.match(r[Column.FAV_SERVICE])
             if ref:
                 self.assign_data(r, ref, True)
                 success_count += 1
-            else:
-                not_founded[name] = r
-        # Additional attempt to search in the remaining elements
-        for n in not_founded:
-            for k in source:
-                if k.startswith(n):
-                    self.assign_data(not_founded[n], source[k], True)
-                    success_count += 1
-                    break
 
         self.update_epg_count()
         self.show_info_message("{} {} {}".format(get_message("Done!"),
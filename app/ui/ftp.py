@@ -11,7 +11,7 @@ from urllib.parse import urlparse, unquote
 from gi.repository import GLib
 
 from app.commons import log, run_task, run_idle
-from app.connections import UtfFTP
+from app.connections import FtpPool
 from app.ui.dialogs import show_dialog, DialogType
 from app.ui.main_helper import on_popup_menu
 from .uicommons import Gtk, Gdk, UI_RESOURCES_PATH, KeyboardKey, MOD_MASK
@@ -43,6 +43,7 @@ class FtpClientBox(Gtk.HBox):
         self._app = app
         self._settings = settings
         self._ftp = None
+        self._ftp_pool = None
         self._select_enabled = True
 
         handlers = {"on_connect": self.on_connect,
@@ -90,6 +91,8 @@ class FtpClientBox(Gtk.HBox):
         # Force Ctrl
         self._ftp_view.connect("key-press-event", self._app.force_ctrl)
         self._file_view.connect("key-press-event", self._app.force_ctrl)
+        # The connection is returned to the pool when the box is destroyed.
+        self.connect("destroy", lambda b: self.release_ftp())
         # Icons
         theme = Gtk.IconTheme.get_default()
         folder_icon = "folder-symbolic" if settings.is_darwin else "folder"
@@ -106,11 +109,9 @@ class FtpClientBox(Gtk.HBox):
     def init_ftp(self):
         GLib.idle_add(self._ftp_model.clear)
         try:
-            if self._ftp:
-                self._ftp.close()
-
-            self._ftp = UtfFTP(host=self._settings.host, user=self._settings.user, passwd=self._settings.password)
-            self._ftp.encoding = "utf-8"
+            self.release_ftp()
+            self._ftp_pool = FtpPool.get(self._settings)
+            self._ftp = self._ftp_pool.acquire()
             self.update_ftp_info(self._ftp.getwelcome())
         except all_errors as e:
             self.update_ftp_info(str(e))
@@ -200,11 +201,16 @@ class FtpClientBox(Gtk.HBox):
         self.init_ftp()
 
     def on_disconnect(self, item=None):
-        if self._ftp:
-            self._ftp.close()
+        self.release_ftp()
         self._connect_button.set_visible(True)
         GLib.idle_add(self._ftp_model.clear)
 
+    def release_ftp(self):
+        """ Returns the current connection to the pool. """
+        if self._ftp:
+            self._ftp_pool.release(self._ftp)
+            self._ftp = None
+
     def on_ftp_row_activated(self, view, path, column):
         row = self._ftp_model[path][:]
         f_path = row[self.Column.NAME]
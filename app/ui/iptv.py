@@ -1,18 +1,17 @@
 import concurrent.futures
 import os
 import re
-import urllib
-from urllib.error import HTTPError
+import urllib.error
 from urllib.parse import urlparse, unquote, quote
-from urllib.request import Request, urlopen
 
 from gi.repository import GLib, Gio, GdkPixbuf
 
 from app.commons import run_idle, run_task, log
 from app.eparser.ecommons import BqServiceType, Service
 from app.eparser.iptv import (NEUTRINO_FAV_ID_FORMAT, StreamType, ENIGMA2_FAV_ID_FORMAT, get_fav_id, MARKER_FORMAT,
-                              parse_m3u)
+                              iter_m3u, get_renumbered_fav_ids)
 from app.settings import SettingsType
+from app.tools.streams import StreamsChecker
 from app.tools.yt import YouTubeException, YouTube
 from app.ui.dialogs import Action, show_dialog, DialogType, get_dialogs_string, get_message
 from app.ui.main_helper import get_base_model, get_iptv_url, on_popup_menu, get_picon_pixbuf
@@ -340,35 +339,28 @@ class SearchUnavailableDialog:
         self._level_bar.set_max_value(self._max_rows)
         self._download_task = True
         self._to_delete = []
+        self._checker = StreamsChecker()
 
         self.update_counter()
         self.do_search()
 
     @run_task
     def do_search(self):
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = {executor.submit(self.get_unavailable, row): row for row in self._iptv_rows}
-            for future in concurrent.futures.as_completed(futures):
-                if not self._download_task:
-                    executor.shutdown()
-                    return
-                future.result()
-            self._download_task = False
-        self.on_close()
+        urls = {}
+        for row in self._iptv_rows:
+            urls.setdefault(get_iptv_url(row, self._s_type), []).append(row)
 
-    def get_unavailable(self, row):
+        self._checker.check(urls, lambda url, available: self.on_checked(urls.get(url, ()), available))
         if not self._download_task:
             return
-        try:
-            req = Request(get_iptv_url(row, self._s_type))
+        self._download_task = False
+        self.on_close()
+
+    def on_checked(self, rows, available):
+        for row in rows:
             self.update_bar()
-            urlopen(req, timeout=2)
-        except HTTPError as e:
-            if e.code != 403:
+            if not available:
                 self.append_data(row)
-        except Exception:
-            self.append_data(row)
 
     def append_data(self, row):
         self._to_delete.append(self._model.get_iter(row.path))
@@ -398,6 +390,7 @@ class SearchUnavailableDialog:
         if self._download_task and show_dialog(DialogType.QUESTION, self._dialog) == Gtk.ResponseType.CANCEL:
             return
         self._download_task = False
+        self._checker.cancel()
         self._dialog.destroy()
 
 
@@ -536,12 +529,13 @@ class IptvListDialog:
 
 class IptvListConfigurationDialog(IptvListDialog):
 
-    def __init__(self, transient, services, iptv_rows, bouquet, fav_model, s_type):
+    def __init__(self, transient, services, iptv_rows, bouquet, fav_model, s_type, fav_view=None):
         super().__init__(transient, s_type)
 
         self._rows = iptv_rows
         self._bouquet = bouquet
         self._fav_model = fav_model
+        self._fav_view = fav_view
         self._services = services
 
     @run_idle
@@ -563,27 +557,29 @@ class IptvListConfigurationDialog(IptvListDialog):
             nid = "0" if nid_default else "{:X}".format(int(self._list_nid_entry.get_text()))
             namespace = "0" if namespace_default else "{:X}".format(int(self._list_namespace_entry.get_text()))
 
-            for index, row in enumerate(self._rows):
-                fav_id = row[Column.FAV_ID]
-                data, sep, desc = fav_id.partition("http")
-                data = data.split(":")
-
-                if self.is_all_data_default():
-                    data[2], data[3], data[4], data[5], data[6] = "10000"
-                else:
-                    data[0], data[2], data[4], data[5], data[6] = stream_type, srv_type, tid, nid, namespace
-                    data[3] = "{:X}".format(index) if sid_auto else "0"
+            fav_ids = [row[Column.FAV_ID] for row in self._rows]
+            if self.is_all_data_default():
+                new_fav_ids = get_renumbered_fav_ids(fav_ids)
+            else:
+                new_fav_ids = get_renumbered_fav_ids(fav_ids, stream_type, srv_type, tid, nid, namespace, sid_auto)
 
-                data = ":".join(data)
-                new_fav_id = "{}{}{}".format(data, sep, desc)
-                row[Column.FAV_ID] = new_fav_id
+            for fav_id, n_id in zip(fav_ids, new_fav_ids):
                 srv = self._services.pop(fav_id, None)
-
                 if srv:
-                    self._services[new_fav_id] = srv._replace(fav_id=new_fav_id)
+                    self._services[n_id] = srv._replace(fav_id=n_id)
+            # Updating the model with the detached view.
+            model = self._fav_view.get_model() if self._fav_view else None
+            if model:
+                self._fav_view.set_model(None)
+            try:
+                for row, n_id in zip(self._rows, new_fav_ids):
+                    self._fav_model.set_value(row.iter, Column.FAV_ID, n_id)
+            finally:
+                if model:
+                    self._fav_view.set_model(model)
 
             self._bouquet.clear()
-            list(map(lambda r: self._bouquet.append(r[Column.FAV_ID]), self._fav_model))
+            self._bouquet.extend(r[Column.FAV_ID] for r in self._fav_model)
 
             self._info_bar.set_visible(True)
 
@@ -638,14 +634,19 @@ class M3uImportDialog(IptvListDialog):
 
     @run_task
     def get_m3u(self, path, s_type):
+        services = []
         try:
             GLib.idle_add(self._spinner.set_property, "active", True)
-            self._services = parse_m3u(path, s_type)
-            for s in self._services:
-                if s.picon:
+            has_picons = False
+            for batch in iter_m3u(path, s_type):
+                services.extend(batch)
+                if not has_picons and any(s.picon for s in batch):
+                    has_picons = True
                     GLib.idle_add(self._picon_box.set_sensitive, True)
-                    break
+                msg = "{} {}...".format(get_message("Streams detected:"), len(services))
+                GLib.idle_add(self._info_label.set_text, msg)
         finally:
+            self._services = services
             msg = "{} {}.".format(get_message("Streams detected:"), len(self._services) if self._services else 0)
             GLib.idle_add(self._info_label.set_text, msg)
             GLib.idle_add(self._spinner.set_property, "active", False)
@@ -10,15 +10,17 @@ from gi.repository import GLib, Gio
 
 from app.commons import run_idle, log, run_task, run_with_delay, init_logger
 from app.connections import (HttpAPI, download_data, DownloadType, upload_data, test_http, TestException,
-                             HttpApiException, STC_XML_FILE)
+                             HttpApiException, STC_XML_FILE, FtpPool)
 from app.eparser import get_blacklist, write_blacklist
 from app.eparser import get_services, get_bouquets, write_bouquets, write_services, Bouquets, Bouquet, Service
-from app.eparser.ecommons import CAS, Flag, BouquetService
+from app.eparser.ecommons import CAS, Flag, BouquetService, parse_flags
 from app.eparser.enigma.bouquets import BqServiceType
-from app.eparser.iptv import export_to_m3u
+from app.eparser.iptv import export_to_m3u, export_bouquets_to_m3u
 from app.eparser.neutrino.bouquets import BqType
 from app.settings import SettingsType, Settings, SettingsException, PlayStreamsMode, SettingsReadException
+from app.tools.epg import EpgIndex
 from app.tools.media import Player, Recorder
+from app.tools.streams import StreamsInfoCache, StreamsProber, get_info_text
 from app.ui.epg_dialog import EpgDialog
 from app.ui.transmitter import LinksTransmitter
 from .backup import BackupDialog, backup_data, clear_data_path
@@ -29,7 +31,8 @@ from .iptv import IptvDialog, SearchUnavailableDialog, IptvListConfigurationDial
 from .main_helper import (insert_marker, move_items, rename, ViewTarget, set_flags, locate_in_services,
                           scroll_to, get_base_model, update_picons_data, copy_picon_reference, assign_picons,
                           remove_picon, is_only_one_item_selected, gen_bouquets, BqGenType, get_iptv_url, append_picons,
-                          get_selection, get_model_data, remove_all_unused_picons, get_picon_pixbuf, get_base_itrs)
+                          get_selection, get_model_data, remove_all_unused_picons, get_picon_pixbuf, get_base_itrs,
+                          get_iptv_url_from_fav_id)
 from .picons_manager import PiconsDialog
 from .satellites_dialog import show_satellites_dialog, ServicesUpdateDialog
 from .search import SearchProvider
@@ -164,6 +167,8 @@ class Application(Gtk.Application):
                     "on_ftp_realize": self.on_ftp_realize,
                     "on_record": self.on_record,
                     "on_remove_all_unavailable": self.on_remove_all_unavailable,
+                    "on_probe_streams": self.on_probe_streams,
+                    "on_export_bouquets_to_m3u": self.on_export_bouquets_to_m3u,
                     "on_new_bouquet": self.on_new_bouquet,
                     "on_create_bouquet_for_current_satellite": self.on_create_bouquet_for_current_satellite,
                     "on_create_bouquet_for_each_satellite": self.on_create_bouquet_for_each_satellite,
@@ -210,6 +215,11 @@ class Application(Gtk.Application):
         self._links_transmitter = None
         self._control_box = None
         self._ftp_client = None
+        # Local EPG [epg.dat]
+        self._epg_index = None
+        # IPTV streams info
+        self._streams_cache = StreamsInfoCache()
+        self._streams_prober = None
         # Appearance
         self._current_font = APP_FONT
         self._picons_size = self._settings.list_picon_size
@@ -329,7 +339,8 @@ class Application(Gtk.Application):
         self._search_entry = builder.get_object("search_entry")
         self._search_provider = SearchProvider((self._services_view, self._fav_view, self._bouquets_view),
                                                builder.get_object("search_down_button"),
-                                               builder.get_object("search_up_button"))
+                                               builder.get_object("search_up_button"),
+                                               self.get_search_extra_text)
         # Dynamically active elements depending on the selected view
         d_elements = (self._SERVICE_ELEMENTS, self._BOUQUET_ELEMENTS, self._COMMONS_ELEMENTS, self._FAV_ELEMENTS,
                       self._FAV_ENIGMA_ELEMENTS, self._FAV_IPTV_ELEMENTS, self._LOCK_HIDE_ELEMENTS)
@@ -428,6 +439,10 @@ class Application(Gtk.Application):
         if self._http_api:
             self._http_api.close()
 
+        if self._ftp_client:
+            self._ftp_client.release_ftp()
+
+        FtpPool.close_all()
         Gtk.Application.do_shutdown(self)
 
     def do_command_line(self, command_line):
@@ -1017,28 +1032,44 @@ class Application(Gtk.Application):
         header, ref = self.get_hint_header_info(srv)
 
         if srv.service_type == "IPTV":
-            return "{}{}".format(header, ref)
+            info = get_info_text(self.get_stream_info(srv))
+            return "{}{}{}".format(header, ref, "\n\n{}: {}".format(get_message("Stream"), info) if info else "")
 
         pol = ", {}: {},".format(get_message("Pol"), srv.pol) if srv.pol else ","
         fec = "{}: {}".format("FEC", srv.fec) if srv.fec else ","
-        ht = "{}{}: {}\n{}: {}\n{}: {}\n{}: {}{} {}, {}\n{}"
+        ht = "{}{}: {}\n{}: {}\n{}: {}\n{}: {}{} {}, {}\n{}{}"
         return ht.format(header,
                          get_message("Package"), srv.package,
                          get_message("System"), srv.system,
                          get_message("Freq"), srv.freq,
                          get_message("Rate"), srv.rate, pol, fec, self.get_ssid_info(srv),
-                         ref)
+                         ref, self.get_hint_epg_info(srv))
 
     def get_hint_for_srv_list(self, srv):
         """ Returns short info about service as formatted string for using as hint. """
         header, ref = self.get_hint_header_info(srv)
-        return "{}{}\n{}".format(header, self.get_ssid_info(srv), ref)
+        return "{}{}\n{}{}".format(header, self.get_ssid_info(srv), ref, self.get_hint_epg_info(srv))
 
     def get_hint_header_info(self, srv):
         header = "{}: {}\n{}: {}\n".format(get_message("Name"), srv.service, get_message("Type"), srv.service_type)
         ref = "{}: {}".format(get_message("Service reference"), srv.picon_id.rstrip(".png"))
         return header, ref
 
+    def get_hint_epg_info(self, srv):
+        """ Returns the current and next events of the service from the local epg.dat. """
+        if not self._epg_index or srv.service_type == "IPTV":
+            return ""
+
+        events = self._epg_index.get_now_next(EpgIndex.get_ref(srv.fav_id))
+        info = []
+        for msg, event in zip(("Now", "Next"), events):
+            if event:
+                start = datetime.fromtimestamp(event.start).strftime("%H:%M")
+                end = datetime.fromtimestamp(event.start + event.duration).strftime("%H:%M")
+                info.append("{}: {} - {} {}".format(get_message(msg), start, end, event.title))
+
+        return "\n\n{}".format("\n".join(info)) if info else ""
+
     def get_ssid_info(self, srv):
         """ Returns SID representation in hex and dec formats. """
         sid = srv.ssid or "0"
@@ -1323,7 +1354,8 @@ class Application(Gtk.Application):
         try:
             download_data(settings=self._settings,
                           download_type=DownloadType.ALL,
-                          callback=lambda x: print(x, end=""))
+                          callback=lambda x: print(x, end=""),
+                          sync=self._settings.sync_transfer)
         except Exception as e:
             msg = "Downloading data error: {}"
             log(msg.format(e), debug=self._settings.debug_mode, fmt_message=msg)
@@ -1356,7 +1388,9 @@ class Application(Gtk.Application):
                         download_type=download_type,
                         remove_unused=True,
                         callback=lambda x: print(x, end=""),
-                        use_http=use_http)
+                        use_http=use_http,
+                        sync=opts.sync_transfer,
+                        use_archive=opts.upload_archive)
         except Exception as e:
             msg = "Uploading data error: {}"
             log(msg.format(e), debug=self._settings.debug_mode, fmt_message=msg)
@@ -1484,6 +1518,7 @@ class Application(Gtk.Application):
         else:
             self.append_blacklist(black_list)
             yield from self.append_data(bouquets, services)
+            self.init_epg_index()
         finally:
             self._wait_dialog.hide()
             self._profile_combo_box.set_sensitive(True)
@@ -1594,10 +1629,8 @@ class Application(Gtk.Application):
             tooltip, background = None, None
             if self._use_colors:
                 flags = srv.flags_cas
-                if flags:
-                    f_flags = list(filter(lambda x: x.startswith("f:"), flags.split(",")))
-                    if f_flags and Flag.is_new(int(f_flags[0][2:])):
-                        background = self._NEW_COLOR
+                if flags and Flag.is_new(parse_flags(flags).flags):
+                    background = self._NEW_COLOR
 
             s = srv._replace(picon=self._picons.get(srv.picon_id, None)) + (tooltip, background)
             self._services_model.append(s)
@@ -1658,8 +1691,12 @@ class Application(Gtk.Application):
         profile = self._s_type
         path = self._settings.data_local_path
         backup_path = self._settings.backup_local_path
-        # Backup data or clearing data path
-        backup_data(path, backup_path) if self._settings.backup_before_save else clear_data_path(path)
+        # Backup data and clearing data path.
+        # Enigma2 bouquet files are kept: only changed ones will be rewritten.
+        keep = (".tv", ".radio") if profile is SettingsType.ENIGMA_2 else ()
+        if self._settings.backup_before_save:
+            backup_data(path, backup_path, move=not keep)
+        clear_data_path(path, keep)
         yield True
 
         bouquets = []
@@ -2148,7 +2185,7 @@ class Application(Gtk.Application):
 
         bq = self._bouquets.get(self._bq_selected, [])
         IptvListConfigurationDialog(self._main_window, self._services, iptv_rows, bq,
-                                    self._fav_model, self._s_type).show()
+                                    self._fav_model, self._s_type, self._fav_view).show()
 
     @run_idle
     def on_remove_all_unavailable(self, action, value=None):
@@ -2169,6 +2206,49 @@ class Application(Gtk.Application):
             gen = self.remove_favs(response, self._fav_model)
             GLib.idle_add(lambda: next(gen, False), priority=GLib.PRIORITY_LOW)
 
+    def on_probe_streams(self, action, value=None):
+        """ Reads the streams parameters [codecs, resolution, bitrate] of the current bouquet into the cache. """
+        iptv_type = BqServiceType.IPTV.value
+        urls = {get_iptv_url(r, self._s_type) for r in self._fav_model if r[Column.FAV_TYPE] == iptv_type}
+        urls.discard(None)
+        if not urls:
+            self.show_error_dialog("This list does not contains IPTV streams!")
+            return
+
+        if self._streams_prober:
+            return
+
+        self._streams_prober = StreamsProber()
+        self._wait_dialog.show()
+        self.probe_streams(urls)
+
+    @run_task
+    def probe_streams(self, urls):
+        try:
+            results = self._streams_prober.probe_all(urls)
+            self._streams_cache.load().update(results)
+            self._streams_cache.save()
+            msg = "{} {}/{}".format(get_message("Done!"), sum(1 for r in results.values() if r), len(urls))
+            GLib.idle_add(show_dialog, DialogType.INFO, self._main_window, msg)
+        finally:
+            self._streams_prober = None
+            GLib.idle_add(self._wait_dialog.hide)
+
+    def get_stream_info(self, srv):
+        """ Returns the cached stream info for the IPTV service. """
+        if srv.service_type != BqServiceType.IPTV.name:
+            return
+        url = get_iptv_url_from_fav_id(srv.fav_id, self._s_type)
+        return self._streams_cache.load().get(url) if url else None
+
+    def get_search_extra_text(self, view, row):
+        """ Returns the stream info of the IPTV rows for searching [e.g. by HD, H.265 or 1920x1080]. """
+        if view is not self._fav_view or row[Column.FAV_TYPE] != BqServiceType.IPTV.value:
+            return ""
+
+        srv = self._services.get(row[Column.FAV_ID], None)
+        return get_info_text(self.get_stream_info(srv)) if srv else ""
+
     # ****************** EPG  **********************#
 
     def on_epg_list_configuration(self, action, value=None):
@@ -2206,14 +2286,28 @@ class Application(Gtk.Application):
             M3uImportDialog(self._main_window, self._s_type, response, self).show()
 
     def append_imported_services(self, services):
+        gen = self.append_bouquet_services(services)
+        GLib.idle_add(lambda: next(gen, False), priority=GLib.PRIORITY_LOW)
+
+    def append_bouquet_services(self, services):
+        """ Appends services to the end of the current bouquet by parts. """
         bq_services = self._bouquets.get(self._bq_selected)
-        self._fav_model.clear()
-        for srv in services:
+        num = sum(1 for r in self._fav_model if r[Column.FAV_TYPE] not in self._marker_types)
+
+        for index, srv in enumerate(services, start=1):
             self._services[srv.fav_id] = srv
             bq_services.append(srv.fav_id)
 
-        gen = self.update_bouquet_services(self._fav_model, None, self._bq_selected)
-        GLib.idle_add(lambda: next(gen, False), priority=GLib.PRIORITY_LOW)
+            srv_type = srv.service_type
+            is_marker = srv_type in self._marker_types
+            if not is_marker:
+                num += 1
+
+            self._fav_model.append((0 if is_marker else num, srv.coded, srv.service, srv.locked, srv.hide, srv_type,
+                                    srv.pos, srv.fav_id, self._picons.get(srv.picon_id, None), None, None))
+            if index % (self.FAV_FACTOR * 10) == 0:
+                yield True
+        yield True
 
     @run_idle
     def on_export_to_m3u(self, action, value=None):
@@ -2239,6 +2333,50 @@ class Application(Gtk.Application):
         else:
             show_dialog(DialogType.INFO, self._main_window, "Done!")
 
+    def on_export_bouquets_to_m3u(self, action, value=None):
+        """ Exports the selected bouquets [or all if nothing is selected] to the *.m3u files. """
+        model, paths = self._bouquets_view.get_selection().get_selected_rows()
+        itrs = [model.get_iter(p) for p in paths if len(p) > 1]
+        if not itrs:
+            itrs = [model.iter_nth_child(r.iter, n) for r in model for n in range(model.iter_n_children(r.iter))]
+
+        i_types = (BqServiceType.IPTV.value, BqServiceType.MARKER.value)
+        bouquets = []
+        for itr in itrs:
+            bq_name, bq_type = model.get(itr, Column.BQ_NAME, Column.BQ_TYPE)
+            bq_id = "{}:{}".format(bq_name, bq_type)
+            ex_s = self._extra_bouquets.get(bq_id, None) or {}
+            services = []
+            for fav_id in self._bouquets.get(bq_id, []):
+                srv = self._services.get(fav_id, None)
+                if srv and srv.service_type in i_types:
+                    services.append(BouquetService(ex_s.get(fav_id, srv.service), BqServiceType(srv.service_type),
+                                                   fav_id, 0))
+
+            if any(s.type is BqServiceType.IPTV for s in services):
+                bouquets.append(Bouquet(bq_name, bq_type, services, None, None, None))
+
+        if not bouquets:
+            self.show_error_dialog("This list does not contains IPTV streams!")
+            return
+
+        response = show_dialog(DialogType.CHOOSER, self._main_window, settings=self._settings)
+        if response in (Gtk.ResponseType.CANCEL, Gtk.ResponseType.DELETE_EVENT):
+            return
+
+        file_name = None
+        msg = "Combine into one file?"
+        if len(bouquets) > 1 and show_dialog(DialogType.QUESTION, self._main_window, msg,
+                                             action_type=Gtk.ButtonsType.YES_NO) == Gtk.ResponseType.YES:
+            file_name = "{}.m3u".format(self._settings.current_profile)
+
+        try:
+            count = export_bouquets_to_m3u(response, bouquets, self._s_type, file_name)
+        except OSError as e:
+            self.show_error_dialog(str(e))
+        else:
+            show_dialog(DialogType.INFO, self._main_window, "{} {}".format(get_message("Done!"), count))
+
     def on_import_data(self, path):
         msg = "Combine with the current data?"
         if len(self._services_model) > 0 and show_dialog(DialogType.QUESTION, self._main_window,
@@ -2792,6 +2930,26 @@ class Application(Gtk.Application):
             self._service_epg_label.set_text(dsc)
             self._service_epg_label.set_tooltip_text(evn.get("e2eventdescription", ""))
 
+    @run_task
+    def init_epg_index(self):
+        """ Loads the local EPG index from the downloaded epg.dat file [Enigma2 only]. """
+        index, self._epg_index = self._epg_index, None
+        if index:
+            index.close()
+
+        if self._s_type is not SettingsType.ENIGMA_2:
+            return
+
+        epg_options = self._settings.epg_options or {}
+        path = epg_options.get("epg_dat_path", self._settings.data_local_path + "epg/") + "epg.dat"
+        if not os.path.isfile(path):
+            return
+
+        try:
+            self._epg_index = EpgIndex.load(path)
+        except (OSError, ValueError) as e:
+            log("Loading EPG data error: {}".format(e))
+
     # ******************* Control *********************** #
 
     def on_control(self, action, state=False):
@@ -639,7 +639,12 @@ def append_text_to_tview(char, view):
 
 def get_iptv_url(row, s_type):
     """ Returns url from iptv type row """
-    data = row[Column.FAV_ID].split(":" if s_type is SettingsType.ENIGMA_2 else "::")
+    return get_iptv_url_from_fav_id(row[Column.FAV_ID], s_type)
+
+
+def get_iptv_url_from_fav_id(fav_id, s_type):
+    """ Returns url from iptv fav id """
+    data = fav_id.split(":" if s_type is SettingsType.ENIGMA_2 else "::")
     if s_type is SettingsType.ENIGMA_2:
         data = list(filter(lambda x: "http" in x, data))
     if data:
@@ -41,6 +41,7 @@ class PiconsDialog:
                     "on_send": self.on_send,
                     "on_download": self.on_download,
                     "on_remove": self.on_remove,
+                    "on_sync_toggled": self.on_sync_toggled,
                     "on_info_bar_close": self.on_info_bar_close,
                     "on_picons_dir_open": self.on_picons_dir_open,
                     "on_selected_toggled": self.on_selected_toggled,
@@ -118,6 +119,8 @@ class PiconsDialog:
         self._send_button = builder.get_object("send_button")
         self._download_button = builder.get_object("download_button")
         self._remove_button = builder.get_object("remove_button")
+        self._sync_button = builder.get_object("sync_button")
+        self._remove_unused_button = builder.get_object("remove_unused_button")
         self._cancel_button = builder.get_object("cancel_button")
         self._enigma2_radio_button = builder.get_object("enigma2_radio_button")
         self._neutrino_mp_radio_button = builder.get_object("neutrino_mp_radio_button")
@@ -140,6 +143,9 @@ class PiconsDialog:
         self._filter_button.bind_property("visible", self._send_button, "visible")
         self._filter_button.bind_property("visible", self._download_button, "visible")
         self._filter_button.bind_property("visible", self._remove_button, "visible")
+        self._filter_button.bind_property("visible", self._remove_unused_button, "visible")
+        # Unused picons are removed in the sync mode only.
+        self._sync_button.bind_property("active", self._remove_unused_button, "sensitive", 2)
         explorer_info_bar = builder.get_object("explorer_info_bar")
         explorer_info_bar.bind_property("visible", builder.get_object("explorer_info_bar_frame"), "visible")
         self._info_check_button.bind_property("active", explorer_info_bar, "visible")
@@ -155,6 +161,7 @@ class PiconsDialog:
         self._ip_entry.set_text(self._settings.host)
         self._picons_entry.set_text(self._settings.picons_path)
         self._picons_dir_entry.set_text(self._settings.picons_local_path)
+        self._sync_button.set_active(self._settings.sync_transfer)
 
         window_size = self._settings.get("picons_downloader_window_size")
         if window_size:
@@ -424,7 +431,9 @@ class PiconsDialog:
                                           callback=self.append_output,
                                           done_callback=lambda: self.show_info_message(get_message("Done!"),
                                                                                        Gtk.MessageType.INFO),
-                                          files_filter=files_filter))
+                                          files_filter=files_filter,
+                                          sync=self._sync_button.get_active(),
+                                          remove_unused=self._remove_unused_button.get_active()))
 
     def on_download(self, item=None, files_filter=None, path=None):
         path = path or self.check_dest_path()
@@ -436,7 +445,11 @@ class PiconsDialog:
         self.run_func(lambda: download_data(settings=settings,
                                             download_type=DownloadType.PICONS,
                                             callback=self.append_output,
-                                            files_filter=files_filter), True)
+                                            files_filter=files_filter,
+                                            sync=self._sync_button.get_active()), True)
+
+    def on_sync_toggled(self, button):
+        self._settings.sync_transfer = button.get_active()
 
     def on_remove(self, item=None, files_filter=None):
         if show_dialog(DialogType.QUESTION, self._dialog) == Gtk.ResponseType.CANCEL:
@@ -132,19 +132,23 @@ class SatellitesDialog:
             view.do_unselect_all(view)
 
     def on_satellites_list_load(self, model):
-        """ Load satellites data into model """
+        """ Load satellites data into model
+
+            The model is filled while the file is being read.
+        """
+        satellites = get_satellites(self._data_path)
         try:
-            satellites = get_satellites(self._data_path)
-            yield True
+            sat = next(satellites, None)
         except FileNotFoundError as e:
             show_dialog(DialogType.ERROR, self._window, getattr(e, "message", str(e)) +
                         "\n\nPlease, download files from receiver or setup your path for read data!")
             return
-        else:
-            model.clear()
-            for sat in satellites:
-                append_satellite(model, sat)
-                yield True
+
+        model.clear()
+        while sat:
+            append_satellite(model, sat)
+            yield True
+            sat = next(satellites, None)
 
     def on_add(self, view):
         """ Common adding """
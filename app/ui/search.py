@@ -2,13 +2,15 @@
 
 
 class SearchProvider:
-    def __init__(self, views, down_button, up_button):
+    def __init__(self, views, down_button, up_button, get_extra_text=None):
+        """ @param get_extra_text: function [view, row] that returns additional text of the row for searching. """
         self._paths = []
         self._current_index = -1
         self._max_indexes = 0
         self._views = views
         self._up_button = up_button
         self._down_button = down_button
+        self._get_extra_text = get_extra_text
 
     def search(self, text):
         self._current_index = -1
@@ -22,7 +24,10 @@ class SearchProvider:
 
             text = text.upper()
             for r in model:
-                if text in str(r[:]).upper():
+                r_text = str(r[:])
+                if self._get_extra_text:
+                    r_text += self._get_extra_text(view, r)
+                if text in r_text.upper():
                     path = r.path
                     selection.select_path(r.path)
                     self._paths.append((view, path))
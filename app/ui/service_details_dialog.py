@@ -6,7 +6,7 @@ from app.eparser import Service
 from app.eparser.ecommons import (MODULATION, Inversion, ROLL_OFF, Pilot, Flag, Pids, POLARIZATION, get_key_by_value,
                                   get_value_by_name, FEC_DEFAULT, PLS_MODE, SERVICE_TYPE, T_MODULATION, C_MODULATION,
                                   TrType, SystemCable, T_SYSTEM, BANDWIDTH, TRANSMISSION_MODE, GUARD_INTERVAL, T_FEC,
-                                  HIERARCHY)
+                                  HIERARCHY, parse_flags)
 from app.settings import SettingsType
 from .dialogs import show_dialog, DialogType, Action, get_dialogs_string
 from .main_helper import get_base_model
@@ -221,51 +221,35 @@ class ServiceDetailsDialog:
     @run_idle
     def init_enigma2_service_data(self, srv):
         """ Service data initialisation """
-        flags = srv.flags_cas
-        if flags:
-            flags = flags.split(",")
+        if srv.flags_cas:
+            flags = parse_flags(srv.flags_cas)
             self.init_enigma2_flags(flags)
             self.init_enigma2_pids(flags)
             self.init_enigma2_cas(flags)
 
     def init_enigma2_flags(self, flags):
-        f_flags = list(filter(lambda x: x.startswith("f:"), flags))
-        if f_flags:
-            value = int(f_flags[0][2:])
+        value = flags.flags
+        if value:
             self._keep_check_button.set_active(Flag.is_keep(value))
             self._hide_check_button.set_active(Flag.is_hide(value))
             self._use_pids_check_button.set_active(Flag.is_pids(value))
             self._new_check_button.set_active(Flag.is_new(value))
 
     def init_enigma2_cas(self, flags):
-        cas = list(filter(lambda x: x.startswith("C:"), flags))
-        if cas:
-            self._cas_entry.set_text(",".join(cas))
+        if flags.cas:
+            self._cas_entry.set_text(",".join(flags.cas))
 
     def init_enigma2_pids(self, flags):
-        pids = list(filter(lambda x: x.startswith("c:"), flags))
-        if pids:
-            for pid in pids:
-                if pid.startswith(Pids.VIDEO.value):
-                    self._video_pid_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.AUDIO.value):
-                    self._audio_pid_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.TELETEXT.value):
-                    self._teletext_pid_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.PCR.value):
-                    self._pcr_pid_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.AC3.value):
-                    self._ac3_pid_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.VIDEO_TYPE.value):
-                    pass
-                elif pid.startswith(Pids.AUDIO_CHANNEL.value):
-                    pass
-                elif pid.startswith(Pids.BIT_STREAM_DELAY.value):
-                    self._bitstream_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.PCM_DELAY.value):
-                    self._pcm_entry.set_text(str(int(pid[4:], 16)))
-                elif pid.startswith(Pids.SUBTITLE.value):
-                    pass
+        pids = flags.pids
+        for pid, entry in ((Pids.VIDEO, self._video_pid_entry),
+                           (Pids.AUDIO, self._audio_pid_entry),
+                           (Pids.TELETEXT, self._teletext_pid_entry),
+                           (Pids.PCR, self._pcr_pid_entry),
+                           (Pids.AC3, self._ac3_pid_entry),
+                           (Pids.BIT_STREAM_DELAY, self._bitstream_entry),
+                           (Pids.PCM_DELAY, self._pcm_entry)):
+            if pid.value in pids:
+                entry.set_text(str(pids[pid.value]))
 
     def init_enigma2_transponder_data(self, srv):
         """ Transponder data initialisation """
@@ -420,8 +404,7 @@ class ServiceDetailsDialog:
         flags = service.flags_cas
         extra_data = {Column.SRV_TOOLTIP: None, Column.SRV_BACKGROUND: None}
         if self._s_type is SettingsType.ENIGMA_2 and flags:
-            f_flags = list(filter(lambda x: x.startswith("f:"), flags.split(",")))
-            if f_flags and Flag.is_new(int(f_flags[0][2:])):
+            if Flag.is_new(parse_flags(flags).flags):
                 extra_data[Column.SRV_BACKGROUND] = self._new_color
 
         self._current_model.set(self._current_itr, extra_data)
@@ -0,0 +1,82 @@
+""" Benchmark of the serial and parallel lamedb parsing.
+
+    Generates lamedb files of different sizes in a temporary dir and prints the parsing time.
+    Run from the project root: python3 -m tests.bench_lamedb [number of services ...]
+"""
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+from app.eparser.cache import pack_services, unpack_services
+from app.eparser.enigma.lamedb import LameDbReader, _CHUNK_SIZE
+
+
+class ForcedParallelReader(LameDbReader):
+    """ Uses the parallel path regardless of the file size and CPU count. """
+
+    def is_parallel(self, file):
+        return True
+
+
+def generate(path, count, fmt=4):
+    """ Writes the lamedb with the given number of services. """
+    rnd = random.Random(count)
+    transponders = []
+    for i in range(max(count // 50, 1)):
+        tr_id = "{:08x}:{:04x}:{:04x}".format(rnd.choice((0xc00000, 0x820000, 0xeeee0000)), i + 1, rnd.randint(1, 200))
+        data = "s {}:27500000:{}:{}:{}:2:0".format(rnd.randint(10700, 12750) * 1000, rnd.randint(0, 1),
+                                                   rnd.randint(0, 9), rnd.choice((130, 192, 360)))
+        transponders.append((tr_id, data))
+
+    lines = ["eDVB services /4/\n", "transponders\n"]
+    for tr_id, data in transponders:
+        lines.append("{}\n\t{}\n/\n".format(tr_id, data))
+    lines.append("end\nservices\n")
+    for i in range(count):
+        tr_id = rnd.choice(transponders)[0]
+        flags = ["p:Provider {}".format(i % 10)]
+        if rnd.random() < 0.3:
+            flags.append("c:00{:04x}".format(i % 999))
+        lines.append("{:04x}:{}:1:0\nChannel {}\n{}\n".format(i + 1, tr_id, i, ",".join(flags)))
+    lines.append("end\n")
+
+    with open(os.path.join(path, "lamedb"), "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    return os.path.getsize(f.name)
+
+
+def measure(reader):
+    start = time.perf_counter()
+    services = reader.parse()
+    return time.perf_counter() - start, services
+
+
+def measure_transfer(services):
+    """ Returns the time of the results transfer [pack, pickle, unpickle, unpack] done in the main process. """
+    start = time.perf_counter()
+    for i in range(0, len(services), _CHUNK_SIZE):
+        unpack_services(pickle.loads(pickle.dumps(pack_services(services[i:i + _CHUNK_SIZE]), -1)))
+    return time.perf_counter() - start
+
+
+def main(counts):
+    cpus = os.cpu_count() or 1
+    print("CPUs: {}".format(cpus))
+    print("{:>9} {:>9} {:>10} {:>12} {:>12}".format("services", "size, MB", "serial, s", "parallel, s", "transfer, s"))
+    with tempfile.TemporaryDirectory() as path:
+        path += os.sep
+        for count in counts:
+            size = generate(path, count)
+            serial, s_services = measure(LameDbReader(path))
+            parallel, p_services = measure(ForcedParallelReader(path, parallel=True))
+            if s_services != p_services:
+                raise ValueError("Results of the serial and parallel parsing differ!")
+            print("{:>9} {:>9.1f} {:>10.2f} {:>12.2f} {:>12.2f}".format(count, size / 1024 ** 2, serial, parallel,
+                                                                       measure_transfer(s_services)))
+
+
+if __name__ == "__main__":
+    main([int(c) for c in sys.argv[1:]] or [5000, 20000, 40000, 80000, 160000])
@@ -0,0 +1,67 @@
+""" Benchmark of the streams availability check.
+
+    Starts a local HTTP stand-in server that answers with the given latency
+    and prints the check time for several per-host limits.
+    The second host is the same server addressed by another name.
+    Run from the project root: python3 -m tests.bench_streams [number of urls] [latency, s]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from app.tools.streams import StreamsChecker
+
+_HOSTS = ("127.0.0.1", "localhost")
+_PORT = 18081
+
+
+async def handle(reader, writer, latency):
+    await reader.readline()
+    while (await reader.readline()).strip():
+        pass
+    await asyncio.sleep(latency)
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+
+def start_servers(latency):
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(asyncio.start_server(lambda r, w: handle(r, w, latency), _HOSTS[0], _PORT,
+                                                     backlog=1024))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+
+
+def measure(urls, **kwargs):
+    StreamsChecker._CACHE.clear()
+    start = time.perf_counter()
+    results = StreamsChecker(**kwargs).check(urls)
+    if not all(results.values()):
+        raise ValueError("Some streams are not available!")
+    return time.perf_counter() - start
+
+
+def main(count=200, latency=0.2):
+    start_servers(latency)
+    one_host = ["http://{}:{}/stream/{}".format(_HOSTS[0], _PORT, i) for i in range(count)]
+    two_hosts = ["http://{}:{}/stream/{}".format(_HOSTS[i % 2], _PORT, i) for i in range(count)]
+
+    print("urls: {}, latency: {} s".format(count, latency))
+    print("{:>9} {:>12} {:>12}".format("per host", "1 host, s", "2 hosts, s"))
+    for per_host in (8, 16, 32, 64):
+        print("{:>9} {:>12.2f} {:>12.2f}".format(per_host, measure(one_host, per_host=per_host),
+                                                 measure(two_hosts, per_host=per_host)))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200, float(args[1]) if len(args) > 1 else 0.2)
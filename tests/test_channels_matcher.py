@@ -0,0 +1,46 @@
+import unittest
+
+from app.tools.epg import ChannelsMatcher
+
+
+class ChannelsMatcherTest(unittest.TestCase):
+    """ Cases for the numbered and variant channel families. """
+
+    def setUp(self):
+        self.matcher = ChannelsMatcher([("Sport 1", "sport_1"),
+                                        ("Sport 2 HD", "sport_2"),
+                                        ("Sport TV", "sport_tv"),
+                                        ("Eurosport 1", "eurosport_1"),
+                                        ("Kino TV", "kino_tv"),
+                                        ("Pro7 MAXX", "pro7_maxx"),
+                                        ("Discovery Channel", "discovery"),
+                                        ("Das Erste HD", "das_erste"),
+                                        ("Первый канал", "perviy")], use_cyrillic=True)
+
+    def test_exact(self):
+        self.assertEqual(self.matcher.match("sport1"), "sport_1")
+        self.assertEqual(self.matcher.match("Sport TV"), "sport_tv")
+
+    def test_quality_suffix(self):
+        self.assertEqual(self.matcher.match("Sport 2"), "sport_2")
+        self.assertEqual(self.matcher.match("Das Erste"), "das_erste")
+        self.assertEqual(self.matcher.match("Kino TV HD"), "kino_tv")
+        self.assertEqual(self.matcher.match("Первый канал HD"), "perviy")
+
+    def test_numbered_family(self):
+        self.assertIsNone(self.matcher.match("Sport 3"))
+        self.assertIsNone(self.matcher.match("Eurosport 2"))
+        self.assertIsNone(self.matcher.match("Kino 1"))
+        self.assertEqual(self.matcher.match("Pro 7 MAXX"), "pro7_maxx")
+
+    def test_variant_family(self):
+        self.assertIsNone(self.matcher.match("Kino"))
+        self.assertIsNone(self.matcher.match("Discovery"))
+        self.assertNotEqual(self.matcher.match("Sport"), "sport_1")
+
+    def test_misspelled(self):
+        self.assertEqual(self.matcher.match("Discovery Chanel"), "discovery")
+
+
+if __name__ == "__main__":
+    unittest.main()